@@ -0,0 +1,64 @@
+from common import *
+import cv2
+import numpy as np
+from inference import INFERENCE_BACKENDS, load_model
+
+def load_frames(source, count):
+    frames = []
+    if source:
+        cap = cv2.VideoCapture(source)
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret: break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        print("No source frames, using random noise")
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 256, (NEXUS_DISPLAY_HEIGHT, NEXUS_DISPLAY_WIDTH, 3), dtype=np.uint8) for _ in range(count)]
+    return frames
+
+def benchmark_backend(name, args, frames):
+    model = load_model(args.model, name)
+    model.set_classes(args.classes)
+
+    for _ in range(args.warmup):
+        model.predict(frames[:args.batch])
+
+    timings = []
+    for i in range(0, len(frames) - args.batch + 1, args.batch):
+        start = time.perf_counter()
+        model.predict(frames[i:i + args.batch])
+        timings.append((time.perf_counter() - start) / args.batch)
+
+    timings = np.array(timings) * 1000
+    return {
+        "backend": name,
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "fps": float(1000 / timings.mean()),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare inference backends on the same frames")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--backends", nargs='+', default=list(INFERENCE_BACKENDS), choices=list(INFERENCE_BACKENDS))
+    parser.add_argument("--source", default=None, help="video file or stream url, random frames when omitted")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--classes", type=lambda s: [c.strip() for c in s.split(',') if c.strip()], default=['person', 'car'])
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.frames)
+    rows = []
+    for name in args.backends:
+        try:
+            rows.append(benchmark_backend(name, args, frames))
+        except Exception as e:
+            print(f"\033[91m{name} failed: {e}\033[0m")
+
+    print(f"\n{'backend':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'fps':>10}")
+    for row in rows:
+        print(f"{row['backend']:<10}{row['mean_ms']:>10.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['fps']:>10.1f}")
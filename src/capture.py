@@ -0,0 +1,112 @@
+from common import *
+import cv2
+import numpy as np
+
+def substream_url(url):
+    """Rewrites a camera main-stream URL to its substream using NEXUS_CAPTURE_SUBSTREAM_RULES."""
+    for main, sub in NEXUS_CAPTURE_SUBSTREAM_RULES:
+        if main in url:
+            return url.replace(main, sub)
+    return url
+
+def fit_size(size, box):
+    """Largest even (width, height) within `box` with the aspect ratio of `size`, never larger than `size`."""
+    width, height = size
+    factor = min(box[0] / width, box[1] / height, 1.0)
+    return max(2, int(width * factor / 2 + 0.5) * 2), max(2, int(height * factor / 2 + 0.5) * 2)
+
+class FFmpegPipeCapture:
+    """cv2.VideoCapture look-alike that lets an ffmpeg process decode, skip and scale frames.
+
+    With `keyframes_only` the decoder drops every non-key frame before decoding it, and with `scale`
+    frames are resized inside the decoder process to fit that (width, height) box at the stream's
+    aspect ratio, so full-resolution pixels never reach Python. get() reports the stream's own size,
+    frames come at (width, height).
+    """
+    def __init__(self, url, scale=None, keyframes_only=False, timeout_ms=VIDEO_CAPTURE_TIMEOUT_MS):
+        self.url = url
+        source = self._probe_size(url, timeout_ms)
+        if scale and all(source):
+            size = fit_size(source, scale)
+        else:
+            # a stream whose size could not be probed is stretched to the box
+            size = scale or source
+        self.source_width, self.source_height = source if all(source) else size
+        self.width, self.height = size
+        self.frame_size = self.width * self.height * 3
+        self.frame = None
+        self.process = None
+        if not self.width or not self.height:
+            return
+
+        args = [NEXUS_FFMPEG_PATH, '-loglevel', 'error', '-nostdin']
+        if url.startswith('rtsp://'):
+            args += ['-rtsp_transport', 'tcp', '-timeout', str(timeout_ms * 1000)]
+        if keyframes_only:
+            args += ['-skip_frame', 'nokey']
+        args += ['-i', url, '-an']
+        if scale:
+            args += ['-vf', f'scale={self.width}:{self.height}']
+        args += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+        try:
+            self.process = subprocess.Popen(args, stdout=subprocess.PIPE, bufsize=0)
+        except OSError as e:
+            print(f"Failed to start ffmpeg: {e}")
+            return
+        # the stream only counts as open once the first frame made it through
+        if not self.grab():
+            self.release()
+
+    @staticmethod
+    def _probe_size(url, timeout_ms):
+        try:
+            out = subprocess.run([NEXUS_FFPROBE_PATH, '-v', 'error', '-select_streams', 'v:0',
+                                  '-show_entries', 'stream=width,height', '-of', 'csv=p=0', url],
+                                 capture_output=True, text=True, timeout=timeout_ms / 1000)
+            width, height = out.stdout.strip().split(',')[:2]
+            return int(width), int(height)
+        except Exception:
+            return 0, 0
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def grab(self):
+        if self.process is None: return False
+        # every frame gets its own array, filled in place straight from the pipe
+        frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        view = memoryview(frame).cast('B')
+        received = 0
+        while received < self.frame_size:
+            count = self.process.stdout.readinto(view[received:])
+            if not count: return False
+            received += count
+        self.frame = frame
+        return True
+
+    def retrieve(self):
+        return (self.frame is not None), self.frame
+
+    def read(self):
+        return self.retrieve() if self.grab() else (False, None)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH: return self.source_width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT: return self.source_height
+        return 0
+
+    def release(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+def open_capture(url, backend=NEXUS_CAPTURE_BACKEND):
+    if NEXUS_CAPTURE_USE_SUBSTREAM:
+        url = substream_url(url)
+    if backend == 'ffmpeg':
+        return FFmpegPipeCapture(url, NEXUS_CAPTURE_SCALE, NEXUS_CAPTURE_KEYFRAMES_ONLY)
+    return cv2.VideoCapture(url, cv2.CAP_FFMPEG, [
+        cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, VIDEO_CAPTURE_TIMEOUT_MS,
+        cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY,
+    ])
@@ -1,30 +1,10 @@
 from common import *
-
-def send_json(sock, data_dict):
-    try:
-        json_bytes = json.dumps(data_dict).encode('utf-8')
-        message = struct.pack('>I', len(json_bytes)) + json_bytes
-        sock.sendall(message)
-        return True
-    except Exception as e:
-        print(f"Send Error: {e}")
-        return False
-
-def recv_json(sock):
-    header = recv_all(sock, CS_JSON_PROTOCOL_HEADER_SIZE)
-    if not header: return None
-    payload = recv_all(sock, struct.unpack('>I', header)[0])
-    return json.loads(payload) if payload else None
-
-def recv_all(sock, n):
-    data = b''
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet: return None
-        data += packet
-    return data
+import select
+from protocol import RecvBuffer, encode_message, recv_json, negotiate_protocol, attachments_size
 
 def generate_image(text_overlay):
+    import cv2
+    import numpy as np
     img = np.zeros((480, 640, 3), dtype=np.uint8)
     
     color = list(np.random.random(size=3) * 256)
@@ -36,8 +16,7 @@ def generate_image(text_overlay):
     cv2.putText(img, f"Time: {datetime.now()}", (10, 450), font, 0.7, (200, 200, 200), 1)
     
     _, buffer = cv2.imencode('.jpg', img)
-    jpg_as_text = base64.b64encode(buffer).decode('utf-8')
-    return jpg_as_text
+    return buffer.tobytes()
 
 def foo_cmd(command_text):
     print(f"Command received: {command_text}")
@@ -48,22 +27,274 @@ def foo_img():
         rets.append(generate_image('foo_img'))
     return rets
 
-def send_image(img, sock):
-    response = {
-        "type": "response",
-        "client_ip": CLIENT_DEVICE_IP,
-        "timestamp": datetime.now().strftime("%Y-%m-%d_%H:%M:%S_%f"),
-        "image": img
-    }
-    if not send_json(sock, response): return False
-    # print("Response sent successfully.")
-    return True
+class UploadScheduler:
+    """Picks what run_client uploads out of what the image getter offers.
+
+    Items are JPEG bytes, (fingerprint, bytes) pairs or (fingerprint, fields, attachments) uploads,
+    fingerprints being the getter's cheaper or more tolerant notion of "same content" than the
+    bytes. Items are returned as (fingerprint, fields, attachments). Whatever was sent and is still offered is
+    not sent again; new items go out within a token-bucket budget of `bytes_per_second`, and
+    items over budget are offered again once the bucket has refilled (`retry_at`).
+    """
+    def __init__(self, bytes_per_second=CLIENT_UPLOAD_BYTES_PER_SECOND):
+        self.bytes_per_second = bytes_per_second
+        self.tokens = float(bytes_per_second)
+        self.last_refill = time.time()
+        self.sent : set = set()
+        self.retry_at = None
+        self.bytes_sent = 0
+        self.suppressed = 0
+        self.deferred = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.bytes_per_second, self.tokens + (now - self.last_refill) * self.bytes_per_second)
+        self.last_refill = now
+
+    def _take(self, size):
+        if not self.bytes_per_second: return True
+        # an item bigger than the whole bucket still goes out when the bucket is full
+        if self.tokens < min(size, self.bytes_per_second): return False
+        self.tokens -= size
+        return True
+
+    def forget(self, fingerprint):
+        """For uploads that were given up on after all, e.g. dropped from the outbound queue."""
+        self.sent.discard(fingerprint)
+
+    def retry_due(self, now):
+        return self.retry_at is not None and now >= self.retry_at
+
+    def select(self, items, now):
+        self._refill(now)
+        self.retry_at = None
+        offered, chosen = set(), []
+        for item in items:
+            if not isinstance(item, tuple):
+                item = (hashlib.blake2b(item, digest_size=8).digest(), item)
+            if len(item) == 2:
+                item = (item[0], {}, {"image": item[1]})
+            fingerprint, fields, attachments = item
+            offered.add(fingerprint)
+            if fingerprint in self.sent:
+                self.suppressed += 1
+                continue
+            size = len(json.dumps(fields)) + sum(len(blob) for blob in attachments.values())
+            if not self._take(size):
+                self.deferred += 1
+                missing = min(size, self.bytes_per_second) - self.tokens
+                self.retry_at = now + missing / self.bytes_per_second
+                continue
+            self.sent.add(fingerprint)
+            self.bytes_sent += size
+            chosen.append((fingerprint, fields, attachments))
+        # something that disappeared and comes back is news again
+        self.sent &= offered
+        return chosen
+
+class SerializedSocket:
+    """One TLS socket shared by a reader and a writer thread.
+
+    OpenSSL does not allow one SSL object to be used from two threads at once, so every call into it
+    holds `lock` and never blocks: the socket is non-blocking and waiting for the network happens
+    outside the lock. Offers what protocol.py needs of a socket; `timeout` works like a socket timeout,
+    `send_timeout`, when set, replaces it for sendall.
+    """
+    def __init__(self, sock : ssl.SSLSocket):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.timeout = sock.gettimeout()
+        self.send_timeout = None
+        sock.setblocking(False)
+
+    def gettimeout(self):
+        return self.timeout
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def _wait(self, writable, deadline):
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not any(select.select([] if writable else [self.sock], [self.sock] if writable else [], [], timeout)):
+            raise socket.timeout("timed out")
+
+    def recv_into(self, view):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            with self.lock:
+                try: return self.sock.recv_into(view)
+                except ssl.SSLWantReadError: writable = False
+                except ssl.SSLWantWriteError: writable = True
+            self._wait(writable, deadline)
+
+    def sendall(self, data):
+        timeout = self.timeout if self.send_timeout is None else self.send_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        view = memoryview(data)
+        while view:
+            with self.lock:
+                try:
+                    view = view[self.sock.send(view):]
+                    continue
+                except ssl.SSLWantWriteError: writable = True
+                except ssl.SSLWantReadError: writable = False
+            self._wait(writable, deadline)
+
+    def shutdown(self, how):
+        with self.lock:
+            self.sock.shutdown(how)
+
+    def close(self):
+        with self.lock:
+            self.sock.close()
+
+class ClientConnection:
+    """Full-duplex connection to the server: a reader thread and a writer thread on one SerializedSocket.
+
+    The reader dispatches commands the moment they arrive. The writer drains two outbound queues:
+    control messages, never dropped and always first, and responses, of which at most
+    CLIENT_OUTBOUND_QUEUE_SIZE wait, the oldest being dropped to make room. Reads never time out,
+    a silently vanished server is found by TCP keepalive within seconds (CLIENT_KEEPALIVE_*); a send
+    chunk the server does not take within CLIENT_SEND_TIMEOUT closes the connection. Until the server
+    has sent anything after the hello, which it does once it admitted us, the operator may still be
+    deciding and sends get CLIENT_ADMISSION_SEND_TIMEOUT instead. close() unblocks both.
+    With `flow_control` responses also wait for credit granted by the server (see protocol.py),
+    meanwhile the drop-oldest queue keeps only the freshest of them.
+    """
+    def __init__(self, sock : socket.socket, version, cmd_handler_callback, max_queued=CLIENT_OUTBOUND_QUEUE_SIZE,
+                 flow_control=False):
+        self.sock = sock
+        self.version = version
+        self.flow_control = flow_control
+        self.credit_messages = 0
+        self.credit_bytes = 0
+        self.cmd_handler_callback = cmd_handler_callback
+        self.max_queued = max_queued
+        self.control : deque = deque()
+        self.responses : deque = deque()
+        self.cond = threading.Condition()
+        self.closed = threading.Event()
+        self.dropped = 0
+        self.admitted = False
+        self.threads = [threading.Thread(target=self._reader_loop, daemon=True),
+                        threading.Thread(target=self._writer_loop, daemon=True)]
+
+    def start(self):
+        self.sock.settimeout(None)
+        self.sock.send_timeout = CLIENT_SEND_TIMEOUT if self.admitted else CLIENT_ADMISSION_SEND_TIMEOUT
+        for thread in self.threads:
+            thread.start()
+
+    def is_open(self):
+        return not self.closed.is_set()
+
+    def close(self):
+        if self.closed.is_set(): return
+        self.closed.set()
+        with self.cond:
+            self.cond.notify_all()
+        try: self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+        try: self.sock.close()
+        except OSError: pass
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def send_control(self, message):
+        with self.cond:
+            self.control.append((None, message, None))
+            self.cond.notify()
+
+    def send_response(self, fields, attachments, tag=None):
+        """Queues a response, returns the tags of responses dropped to make room for it."""
+        response = {
+            "type": "response",
+            "client_ip": CLIENT_DEVICE_IP,
+            "timestamp": datetime.now().strftime("%Y-%m-%d_%H:%M:%S_%f"),
+            **fields,
+        }
+        if self.version >= CS_PROTOCOL_V2 or not attachments:
+            messages = [(tag, response, attachments)]
+        else:
+            # v1 peers know a single "image" per message: one message per attachment, same fields on each
+            messages = [(tag, response, {"image": img}) for img in attachments.values()]
+
+        dropped = []
+        with self.cond:
+            for message in messages:
+                if len(self.responses) >= self.max_queued:
+                    dropped.append(self.responses.popleft()[0])
+                    self.dropped += 1
+                self.responses.append(message)
+            self.cond.notify()
+        return dropped
+
+    def _may_send_response(self):
+        return not self.flow_control or (self.credit_messages > 0 and self.credit_bytes > 0)
+
+    def _next_message(self):
+        with self.cond:
+            while not self.control and not (self.responses and self._may_send_response()) and not self.closed.is_set():
+                self.cond.wait()
+            if self.closed.is_set(): return None
+            if self.control:
+                return self.control.popleft()
+            item = self.responses.popleft()
+            if self.flow_control:
+                self.credit_messages -= 1
+                self.credit_bytes -= attachments_size(item[2])
+            return item
+
+    def _writer_loop(self):
+        try:
+            while True:
+                item = self._next_message()
+                if item is None: return
+                _, message, attachments = item
+                view = memoryview(encode_message(message, attachments, self.version))
+                for offset in range(0, len(view), CLIENT_SEND_CHUNK_SIZE):
+                    self.sock.sendall(view[offset:offset + CLIENT_SEND_CHUNK_SIZE])
+        except Exception as e:
+            if self.is_open(): print(f"\033[91mSend error: {e}\033[0m")
+        finally:
+            self.close()
+
+    def _reader_loop(self):
+        recv_buffer = RecvBuffer()
+        try:
+            while self.is_open():
+                message = recv_json(self.sock, recv_buffer)
+                if not message:
+                    if self.is_open(): print("Server closed connection.")
+                    return
+                self.dispatch(message)
+        except Exception as e:
+            if self.is_open(): print(f"\033[91mReceive error: {e}\033[0m")
+        finally:
+            self.close()
+
+    def dispatch(self, message):
+        if not self.admitted:
+            # anything after the hello means the server is reading us now
+            self.admitted = True
+            self.sock.send_timeout = CLIENT_SEND_TIMEOUT
+        if message.get('type') == 'query':
+            self.cmd_handler_callback(message.get('command'))
+        elif message.get('type') == 'credit':
+            with self.cond:
+                self.credit_messages += int(message.get('messages', 0))
+                self.credit_bytes += int(message.get('bytes', 0))
+                self.cond.notify()
 
 def connect_to_server(server_ip, server_port):
     print(f"Attempting connection to {server_ip}:{server_port}...")
 
     context = ssl.create_default_context()
     context.load_verify_locations(SERVER_CERT_PATH)
+    if os.path.exists(CLIENT_CERT_PATH):
+        context.load_cert_chain(certfile=CLIENT_CERT_PATH, keyfile=CLIENT_KEY_PATH)
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(C2S_CONNECTION_TIMEOUT)
@@ -71,40 +302,74 @@ def connect_to_server(server_ip, server_port):
     sock = context.wrap_socket(sock, server_hostname=server_ip)
 
     sock.connect((server_ip, int(server_port)))
-    sock.settimeout(CLIENT_RECEIVE_TIMEOUT)
+    enable_keepalive(sock)
     print(f"Connected to Server!")
-    return sock
+    return SerializedSocket(sock)
+
+def enable_keepalive(sock):
+    # a silently vanished server is noticed by the reader, which never times out on its own,
+    # within seconds instead of the hours the OS defaults to, where the platform lets us choose
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    idle_option = getattr(socket, 'TCP_KEEPIDLE', getattr(socket, 'TCP_KEEPALIVE', None))
+    for option, value in ((idle_option, CLIENT_KEEPALIVE_IDLE),
+                          (getattr(socket, 'TCP_KEEPINTVL', None), CLIENT_KEEPALIVE_INTERVAL),
+                          (getattr(socket, 'TCP_KEEPCNT', None), CLIENT_KEEPALIVE_COUNT)):
+        if option is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, option, value)
 
 stop_event = threading.Event()
 def stop_client():
     stop_event.set()
 
-def run_client(server_ip, server_port, cmd_handler_callback, img_getter_callback):
+def run_client(server_ip, server_port, cmd_handler_callback, img_getter_callback, changed_event : threading.Event = None,
+               selected_callback=None):
+    """Without `changed_event` the getter is polled every CLIENT_SEND_MESSAGE_INTERVAL, with it the getter
+    is asked as soon as the event is set. Either way UploadScheduler decides what is actually sent,
+    `selected_callback(fingerprint, fields, attachments)` hears about each upload it picks,
+    and commands are handled by the connection's reader as they arrive."""
+    conn = None
+    sock = None
     try:
         stop_event.clear()
-        sock : socket.socket = connect_to_server(server_ip, server_port)
+        sock = connect_to_server(server_ip, server_port)
+        version, flow_control, query = negotiate_protocol(sock, RecvBuffer())
+        print(f"Using protocol v{version}" + (" with flow control" if flow_control else ""))
+        conn = ClientConnection(sock, version, cmd_handler_callback, flow_control=flow_control)
+        if query is not None:
+            conn.dispatch(query)
+        conn.start()
+
+        uploads = UploadScheduler()
         last_img_time = 0
-        while not stop_event.is_set():
+        # whatever is there now is news to this connection, even if it has not changed lately
+        if changed_event is not None: changed_event.set()
+        while not stop_event.is_set() and conn.is_open():
             current_time = time.time()
-            if current_time - last_img_time >= CLIENT_SEND_MESSAGE_INTERVAL:
-                imgs = img_getter_callback()
-                for img in imgs:
-                    if not send_image(img, sock): return
+            if changed_event is None:
+                due = current_time - last_img_time >= CLIENT_SEND_MESSAGE_INTERVAL
+            else:
+                due = changed_event.is_set() or uploads.retry_due(current_time)
+            if due:
+                if changed_event is not None: changed_event.clear()
+                for fingerprint, fields, attachments in uploads.select(img_getter_callback(), current_time):
+                    if selected_callback: selected_callback(fingerprint, fields, attachments)
+                    for dropped in conn.send_response(fields, attachments, fingerprint):
+                        uploads.forget(dropped)
                 last_img_time = current_time
 
-            try:
-                query : dict = recv_json(sock)
-                if not query:
-                    print("Server closed connection.")
-                    return
-            except (socket.timeout, TimeoutError):
-                continue
-
-            if query.get('type') == 'query':
-                command_text = query.get('command')
-                cmd_handler_callback(command_text)
+            if changed_event is None:
+                stop_event.wait(min(CLIENT_WAKE_INTERVAL, max(0.0, last_img_time + CLIENT_SEND_MESSAGE_INTERVAL - time.time())))
+            else:
+                wait = CLIENT_WAKE_INTERVAL
+                if uploads.retry_at is not None:
+                    wait = min(wait, max(0.0, uploads.retry_at - time.time()))
+                changed_event.wait(wait)
     except Exception as e:
         print(f"\033[91mConnection error: {e}\033[0m")
     finally:
-        try: sock.close()
-        except: pass
+        if conn is not None:
+            conn.close()
+            conn.join(timeout=1.0)
+        elif sock is not None:
+            try: sock.close()
+            except: pass
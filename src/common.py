@@ -6,19 +6,22 @@ import threading
 import time
 import base64
 import sys
-import torch
-import cv2
 import queue
+import asyncio
+import ipaddress
+import hashlib
+import tempfile
+import heapq
+import itertools
+import mmap
+import shutil
+import argparse
+import subprocess
 import ssl
-import numpy as np
 from datetime import datetime
-from ultralytics import YOLO
-from PySide6.QtCore import Qt, Signal, QObject, Slot, QTimer, QThread
-from PySide6.QtGui import QImage, QPixmap, QTextCursor, QColor, QIntValidator
-from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                               QHBoxLayout, QLabel, QLineEdit, QPushButton, 
-                               QListWidget, QTextEdit, QSplitter, QGroupBox, 
-                               QMessageBox, QListWidgetItem, QMenu, QCheckBox, QFormLayout)
+from collections import deque, namedtuple, OrderedDict
+# Standard library only: numpy, cv2, torch, ultralytics and Qt are imported by the modules that use them,
+# so the server and the protocol client never pay for the inference stack.
 
 
 NEXUS_DISPLAY_WIDTH = 640
@@ -27,7 +30,21 @@ NEXUS_INFERENCE_WIDTH = NEXUS_DISPLAY_WIDTH#320
 NEXUS_INFERENCE_HEIGHT = NEXUS_DISPLAY_HEIGHT#256
 
 NEXUS_DEFAULT_FPS = 30
-# DETECTION_SKIP_FRAMES = 30
+NEXUS_DETECTION_SKIP_FRAMES = 5
+NEXUS_TRACKER_MIN_QUALITY = 0.5
+NEXUS_TRACKER_SCALE = 0.5
+NEXUS_TRACKER_POINTS_PER_BOX = 12
+NEXUS_TRACKER_MIN_POINTS = 3
+NEXUS_PIPELINE_QUEUE_SIZE = 1
+NEXUS_PIPELINE_POLL_INTERVAL = 0.1
+NEXUS_RENDER_BUFFER_COUNT = 3
+NEXUS_BATCHED_INFERENCE = True
+NEXUS_INFERENCE_MAX_BATCH = 8
+NEXUS_INFERENCE_BATCH_WINDOW = 0.035 # about a frame at NEXUS_DEFAULT_FPS, streams join a detection round on their next frame
+NEXUS_STREAM_URL_SEPARATOR = ','
+NEXUS_VIDEO_GRID_COLUMNS = 2
+EDGE_STATS_INTERVAL = 10.0
+EDGE_RECONNECT_INTERVAL = 5.0
 STATUS_CONNECTING_COLOR = "blue"
 STATUS_CONNECTED_COLOR = "green"
 STATUS_DISCONNECTED_COLOR = "orange"
@@ -38,13 +55,38 @@ MODEL_PATH = "./models/yolov8s-world.pt"
 # MODEL_PATH = "./models/yolov8s-worldv2.pt"
 # MODEL_PATH = "./models/yolov8m-worldv2.pt"
 INFERENCE_DEVICE = 'cpu'
+INFERENCE_BACKEND = 'torch' # 'torch', 'torchscript' (traced), 'onnx' (ONNX Runtime) or 'openvino'
+INFERENCE_EXPORT_DIR = "./models/exports"
+INFERENCE_EMBEDDING_CACHE_DIR = "./models/cache"
+INFERENCE_EMBEDDING_CACHE_SIZE = 1024
+INFERENCE_WARMUP = True
+INFERENCE_WARMUP_RUNS = 3
 VIDEO_CAPTURE_TIMEOUT_MS = 5000
+NEXUS_CAPTURE_BACKEND = 'opencv' # 'opencv' or 'ffmpeg' (decode/scale/skip in an ffmpeg process)
+NEXUS_CAPTURE_USE_SUBSTREAM = False
+NEXUS_CAPTURE_SUBSTREAM_RULES = [('/Streaming/Channels/101', '/Streaming/Channels/102'), # Hikvision
+                                 ('subtype=0', 'subtype=1')] # Dahua
+NEXUS_CAPTURE_SCALE = (NEXUS_INFERENCE_WIDTH, NEXUS_INFERENCE_HEIGHT) # ffmpeg backend only, box frames are fit into keeping their aspect ratio, None keeps native size
+NEXUS_CAPTURE_KEYFRAMES_ONLY = False # ffmpeg backend only
+NEXUS_CAPTURE_RETRIEVE_ON_DEMAND = True
+NEXUS_FFMPEG_PATH = 'ffmpeg'
+NEXUS_FFPROBE_PATH = 'ffprobe'
 POST_CAMERA_RECONNECT_WAIT_ITERATIONS = 20
 POST_CAMERA_RECONNECT_WAIT_INTERVAL = 0.1
 
 SERVER_CERT_PATH = './ssl-files/server.crt'
 SERVER_KEY_PATH = './ssl-files/server.key'
+SERVER_CLIENT_CA_PATH = './ssl-files/clients-ca.crt'
+CLIENT_CERT_PATH = './ssl-files/client.crt'
+CLIENT_KEY_PATH = './ssl-files/client.key'
 CS_JSON_PROTOCOL_HEADER_SIZE = 4
+CS_PROTOCOL_V1 = 1
+CS_PROTOCOL_V2 = 2
+CS_PROTOCOL_VERSION = CS_PROTOCOL_V2
+CS_PROTOCOL_NEGOTIATION_TIMEOUT = 2.0
+CS_BINARY_FIELDS = ('image',)
+CS_RECV_BUFFER_INITIAL_SIZE = 64 * 1024
+CS_FLOW_CONTROL = True # offer credit-based flow control in the hello
 C2S_CONNECTION_TIMEOUT = 5
 
 SERVER_SYS_LOG_MAX_SIZE = 1024
@@ -52,9 +94,53 @@ SERVER_SYS_LOG_DELETE_LOG_SIZE = 512
 SERVER_BIND_IP = '127.0.0.1'
 SERVER_PORT = 5000
 SERVER_BACKLOG = 128
+SERVER_SSL_HANDSHAKE_TIMEOUT = 10
+SERVER_HELLO_TIMEOUT = 1.0 # wait for a client's hello before admission, below CS_PROTOCOL_NEGOTIATION_TIMEOUT
+SERVER_FIRST_MESSAGE_TIMEOUT = 5 # a first message that started must be complete within this
+SERVER_FIRST_MESSAGE_MAX_SIZE = 2 * 1024 * 1024 # a hello or one legacy image, larger is rejected before admission
+SERVER_SEND_TIMEOUT = 5 # a client that does not take a message within this is disconnected
+SERVER_CLIENT_WRITE_QUEUE_SIZE = 64
+SERVER_ADMISSION_AUTO_ACCEPT = False
+SERVER_ADMISSION_ALLOWLIST = []
+SERVER_ADMISSION_DENYLIST = []
+SERVER_ADMISSION_FINGERPRINTS = []
+SERVER_ADMISSION_READMIT_SECONDS = 600
+SERVER_ADMISSION_TIMEOUT_SECONDS = 120
+SERVER_CLIENT_PRIORITIES = {} # host -> 'low', 'normal' or 'high', anything unlisted is 'normal'
+SERVER_CREDIT_WINDOW_MESSAGES = 8 # responses a client may have in flight
+SERVER_CREDIT_WINDOW_BYTES = 4 * 1024 * 1024 # attachment bytes a client may have in flight
+SERVER_CREDIT_REFILL_INTERVAL = 0.2
+# server load (0..1) from which a priority gets no new credit until the load drops again
+SERVER_CREDIT_THROTTLE_LOAD = {'low': 0.5, 'normal': 0.85, 'high': float('inf')}
 SENT_COMMAND_HISTORY_SIZE_LIMIT = 10
 SERVER_NOTIFY_SOUND_COOLDOWN_SECONDS = 5
+SERVER_DISPLAY_MAX_FPS = 15
+SERVER_RESPONSE_IDLE_SECONDS = 5 # a client silent this long gets a new alert when it responds again
+SERVER_DECODE_POOL_SIZE = 2
+SERVER_STORAGE_ENABLED = True
+SERVER_STORAGE_DIR = "received_data"
+SERVER_STORAGE_SEGMENT_SIZE = 64 * 1024 * 1024
+SERVER_STORAGE_FSYNC_POLICY = 'interval'
+SERVER_STORAGE_FSYNC_INTERVAL = 1.0
+SERVER_STORAGE_QUEUE_SIZE = 4096
+SERVER_STORAGE_BATCH_RECORDS = 256
+SERVER_STORAGE_BATCH_BYTES = 8 * 1024 * 1024
+SERVER_STORAGE_BATCH_WAIT = 0.2
+SERVER_BROWSE_PAGE_SIZE = 50
 
 CLIENT_DEVICE_IP = '192.168.1.101/dummy'
-CLIENT_RECEIVE_TIMEOUT = 0.5
-CLIENT_SEND_MESSAGE_INTERVAL = 1.0
+CLIENT_WAKE_INTERVAL = 0.5 # longest the upload loop sleeps before rechecking stop and the connection
+CLIENT_OUTBOUND_QUEUE_SIZE = 16 # responses waiting for the writer, the oldest is dropped beyond this
+CLIENT_SEND_CHUNK_SIZE = 256 * 1024
+CLIENT_SEND_TIMEOUT = 10 # a chunk the server does not take within this closes the connection
+# until the server is heard from after the hello it may not be reading yet, waiting for the operator to admit us
+CLIENT_ADMISSION_SEND_TIMEOUT = SERVER_ADMISSION_TIMEOUT_SECONDS + CLIENT_SEND_TIMEOUT
+CLIENT_KEEPALIVE_IDLE = 10 # s of silence before TCP keepalive probes, instead of the OS default of hours
+CLIENT_KEEPALIVE_INTERVAL = 5
+CLIENT_KEEPALIVE_COUNT = 3 # unanswered probes until the server counts as gone
+CLIENT_SEND_MESSAGE_INTERVAL = 1.0 # polling getters only, event-driven uploads go out as soon as detections change
+CLIENT_UPLOAD_BYTES_PER_SECOND = 1024 * 1024 # 0 = unlimited
+CLIENT_UPLOAD_BOX_QUANTUM = 32 # px, box jitter below this does not count as a change
+CLIENT_UPLOAD_CROPS = True # False (and no keyframes) = metadata-only uploads
+CLIENT_UPLOAD_KEYFRAME_INTERVAL = 10.0 # s between full-frame keyframes per stream, 0 = never
+CLIENT_UPLOAD_KEYFRAME_QUALITY = 70
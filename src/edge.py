@@ -0,0 +1,118 @@
+import client
+import engine
+from common import *
+import signal
+import cv2
+from inference import INFERENCE_BACKENDS, load_model
+from engine import StreamEngine
+
+# Headless edge client: capture -> inference -> upload for any number of streams, no Qt.
+# Settings come from an optional JSON file (same keys as the long options, e.g.
+# {"streams": ["rtsp://..."], "server": "10.0.0.5:5000", "classes": ["person"]}), command line wins.
+EDGE_DEFAULTS = {
+    "streams": [],
+    "server": None,
+    "model": MODEL_PATH,
+    "backend": INFERENCE_BACKEND,
+    "classes": [],
+    "fps": NEXUS_DEFAULT_FPS,
+    "stats_interval": EDGE_STATS_INTERVAL,
+    "metadata_only": not CLIENT_UPLOAD_CROPS and not CLIENT_UPLOAD_KEYFRAME_INTERVAL,
+}
+
+def load_config(args):
+    config = dict(EDGE_DEFAULTS)
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            file_config = json.load(f)
+        unknown = set(file_config) - set(EDGE_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+        config.update(file_config)
+    for key in EDGE_DEFAULTS:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+    return config
+
+def stream_logger(stream_id):
+    def log(message, *args):
+        print(f"[stream {stream_id}] {message}")
+    return log
+
+def uploader(server, metadata_only, stop):
+    """Keeps client.run_client connected, reconnecting after EDGE_RECONNECT_INTERVAL until `stop` is set."""
+    server_ip, server_port = server.rsplit(':', 1)
+    if metadata_only:
+        get_uploads = lambda: engine.encode_detections(crops=False, keyframe_interval=0)
+    else:
+        get_uploads = engine.encode_detections
+    while not stop.is_set():
+        client.run_client(server_ip, server_port, engine.queue_command, get_uploads, engine.detections_changed,
+                          engine.upload_selected)
+        stop.wait(EDGE_RECONNECT_INTERVAL)
+
+def run_edge(config):
+    if not config["streams"]:
+        raise ValueError("No streams configured")
+
+    engine.classes = list(config["classes"])
+    engine.model = load_model(config["model"], config["backend"], engine.classes if engine.classes else [''])
+
+    scheduler = engine.get_inference_scheduler() if NEXUS_BATCHED_INFERENCE or len(config["streams"]) > 1 else None
+    streams = []
+    for stream_id, url in enumerate(config["streams"]):
+        log = stream_logger(stream_id)
+        streams.append(StreamEngine(url, stream_id, scheduler, config["fps"],
+                                    on_status=log, on_error=log, on_connection_failed=log))
+    for stream in streams:
+        stream.start()
+
+    stop = threading.Event()
+    upload_thread = None
+    if config["server"]:
+        upload_thread = threading.Thread(target=uploader, args=(config["server"], config["metadata_only"], stop), daemon=True)
+        upload_thread.start()
+
+    # a service manager stops us with SIGTERM, shut down as cleanly as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        while not stop.is_set() and any(stream.running() for stream in streams):
+            stop.wait(config["stats_interval"])
+            for stream in streams:
+                print(f"[stream {stream.stream_id}] {stream.incoming_res()} #{stream.latest_frame_id}: "
+                      f"{stream.frames_processed} processed, {stream.duplicate_frames_skipped} dup")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        client.stop_client()
+        for stream in streams:
+            stream.stop()
+        if upload_thread:
+            upload_thread.join(timeout=1.0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run detection on camera streams and upload results, without a GUI")
+    parser.add_argument("--config", default=None, help="JSON file with any of the options below")
+    parser.add_argument("--streams", nargs='+', default=None, help="stream urls")
+    parser.add_argument("--server", default=None, help="server ip:port, nothing is uploaded when omitted")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--backend", default=None, choices=list(INFERENCE_BACKENDS))
+    parser.add_argument("--classes", type=lambda s: [c.strip() for c in s.split(',') if c.strip()], default=None)
+    parser.add_argument("--fps", type=int, default=None)
+    parser.add_argument("--stats-interval", dest="stats_interval", type=float, default=None)
+    parser.add_argument("--metadata-only", dest="metadata_only", action='store_const', const=True, default=None,
+                        help="upload detections without crops or keyframes")
+    args = parser.parse_args()
+
+    cv2.setNumThreads(8)
+    cv2.setUseOptimized(True)
+
+    config = load_config(args)
+    if not os.path.exists(config["model"]):
+        print(f"Error: Model file '{config['model']}' not found.")
+        sys.exit(1)
+    # +class/-class on stdin, as in the GUI client; running as a service stdin is closed and this just ends
+    threading.Thread(target=engine.input_thread, daemon=True).start()
+    run_edge(config)
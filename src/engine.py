@@ -0,0 +1,407 @@
+from common import *
+import cv2
+import numpy as np
+from inference import InferenceScheduler, InferenceBackend
+from tracker import BoxTracker
+from pipeline import DropOldestQueue
+from capture import open_capture
+
+# Capture -> inference -> detections, without Qt. The GUI client (main.py) draws what this produces,
+# the headless edge client (edge.py) only uploads it.
+
+model : InferenceBackend = None
+classes : list[str] = []
+command_queue : queue.Queue = queue.Queue()
+# stream_id -> DetectionSnapshot, replaced as a whole and never mutated in place
+latest_detections : dict[int, tuple] = {}
+latest_detections_lock = threading.Lock()
+# set when a stream's detections change or its keyframe falls due, lets client.run_client upload right then
+detections_changed = threading.Event()
+# fingerprint -> JPEG of the crops handed out by the last encode_detections call
+encoded_crops : dict[bytes, bytes] = {}
+# stream_id -> time the last keyframe was picked for upload (see upload_selected)
+keyframe_times : dict[int, float] = {}
+# stream_id -> keyframe_times value when the next keyframe was last asked for
+keyframe_requests : dict[int, float] = {}
+inference_scheduler : InferenceScheduler = None
+
+# box is (x1, y1, x2, y2) in frame pixels, crop is a read-only copy of that region
+Detection = namedtuple('Detection', ['label', 'conf', 'box', 'crop'])
+# everything found in one frame; `frame` is the full captured frame and must not be written to,
+# `source_size` the stream's own (width, height), larger than the frame when the capture scales,
+# `fingerprints` one detection_fingerprint per detection, filled in by publish_detections
+DetectionSnapshot = namedtuple('DetectionSnapshot', ['frame_id', 'capture_time', 'frame', 'detections', 'source_size',
+                                                     'fingerprints'], defaults=[None])
+
+def detect_objects(frame, model : InferenceBackend, classes : list[str]):
+    results = model.predict(frame)
+    return results[0].plot()
+
+def predict_batch(frames):
+    return model.predict(frames)
+
+def get_inference_scheduler() -> InferenceScheduler:
+    global inference_scheduler
+    if inference_scheduler is None:
+        inference_scheduler = InferenceScheduler(predict_batch, pre_batch_hook=update_model_classes)
+    return inference_scheduler
+
+def input_thread():
+    global command_queue
+    print("Input thread started. Enter +class to add or -class to remove (e.g., +cat, -dog).")
+    while True:
+        try:
+            user_input = input().strip()
+            command_queue.put(user_input)
+        except EOFError:
+            break
+        except Exception as e:
+            pass
+
+def queue_command(command_text : str):
+    command_queue.put(command_text.strip())
+
+def update_model_classes():
+    global command_queue, classes, model
+    updated_classes = False
+    while not command_queue.empty():
+        updated_classes = True
+        command = command_queue.get()
+        try:
+            action = command[0]
+            class_name = command[1:].strip()
+            if action == '+' and class_name and class_name not in classes:
+                classes.append(class_name)
+            elif action == '-' and class_name in classes:
+                classes.remove(class_name)
+            print(f"Updated classes: {classes}")
+        except Exception as e:
+            print(f"Command Error: {e}")
+    if updated_classes:
+        target_classes = classes if classes else ['']
+        model.set_classes(target_classes)
+
+def extract_detections(frame, results):
+    """Turns ultralytics results into Detections, cropped out of the full-resolution `frame`."""
+    if results is None: return None
+
+    # one device->host transfer per frame instead of indexing tensors per box
+    data = results.boxes.data.cpu().numpy()
+    h, w = frame.shape[:2]
+    boxes = np.clip(data[:, :4], 0, [w, h, w, h]).astype(int)
+    labels = [results.names.get(int(cls_id), '') for cls_id in data[:, 5]]
+
+    detections = []
+    for (x1, y1, x2, y2), label_name, conf in zip(boxes.tolist(), labels, data[:, 4].tolist()):
+        crop = frame[y1:y2, x1:x2].copy()
+        crop.flags.writeable = False
+        detections.append(Detection(label_name, conf, (x1, y1, x2, y2), crop))
+    return tuple(detections)
+
+def publish_detections(stream_id, snapshot):
+    global latest_detections
+    if snapshot is not None:
+        snapshot = snapshot._replace(fingerprints=tuple(detection_fingerprint(stream_id, detection)
+                                                        for detection in snapshot.detections))
+    # copy-on-write: readers keep whatever dict they grabbed, nothing they hold is ever modified
+    with latest_detections_lock:
+        detections = dict(latest_detections)
+        previous = detections.pop(stream_id, None)
+        if snapshot is not None: detections[stream_id] = snapshot
+        latest_detections = detections
+    # a new frame of the same scene is no news to the uploader
+    if (previous is None) != (snapshot is None) \
+            or (snapshot is not None and sorted(previous.fingerprints) != sorted(snapshot.fingerprints)) \
+            or (snapshot is not None and keyframe_wanted(stream_id)):
+        detections_changed.set()
+
+def keyframe_wanted(stream_id):
+    """True once for every keyframe that falls due, so a static scene still wakes the uploader for it."""
+    last = keyframe_times.get(stream_id, 0)
+    if not CLIENT_UPLOAD_KEYFRAME_INTERVAL or time.time() - last < CLIENT_UPLOAD_KEYFRAME_INTERVAL: return False
+    if keyframe_requests.get(stream_id) == last: return False
+    keyframe_requests[stream_id] = last
+    return True
+
+def detection_fingerprint(stream_id, detection):
+    """Cheap content key of a detection: label, coarse box and an 8x8 average hash of the crop,
+    so sensor noise and box jitter between frames do not make a static scene look new."""
+    coarse_box = tuple(v // CLIENT_UPLOAD_BOX_QUANTUM for v in detection.box)
+    key = repr((stream_id, detection.label, coarse_box)).encode('utf-8')
+    if detection.crop.size:
+        gray = cv2.cvtColor(detection.crop, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA)
+        key += np.packbits(thumb > thumb.mean()).tobytes()
+    return hashlib.blake2b(key, digest_size=8).digest()
+
+def encode_jpeg(img, quality=95):
+    _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+def source_scale(snapshot):
+    """(x, y, x, y) factors from frame pixels to the stream's own pixels."""
+    height, width = snapshot.frame.shape[:2]
+    source_width, source_height = snapshot.source_size
+    if not source_width or not source_height: return (1, 1, 1, 1)
+    return (source_width / width, source_height / height) * 2
+
+def encode_detections(crops=CLIENT_UPLOAD_CROPS, keyframe_interval=CLIENT_UPLOAD_KEYFRAME_INTERVAL):
+    """One upload per stream for client.run_client: (fingerprint, fields, attachments).
+
+    `fields` describes every detection (class, conf, box in the stream's own pixels) of the latest frame, so the
+    server never has to look at pixels. With `crops` each detection also gets its JPEG crop attached
+    as "crop_<i>", and every `keyframe_interval` seconds the full frame goes out as a separate upload
+    with the same fields (without crop references) and a "keyframe" attachment.
+    The fingerprint only changes with the detections, so an unchanged scene is not uploaded again.
+    """
+    global encoded_crops
+    with latest_detections_lock:
+        snapshots = latest_detections
+    now = time.time()
+    uploads, encoded = [], {}
+    for stream_id, snapshot in snapshots.items():
+        fingerprints = snapshot.fingerprints
+        scale = source_scale(snapshot)
+        described = [{"class": detection.label, "conf": round(detection.conf, 4),
+                      "box": [round(v * f) for v, f in zip(detection.box, scale)]}
+                     for detection in snapshot.detections]
+        attachments = {}
+        if crops:
+            for i, (detection, fingerprint) in enumerate(zip(snapshot.detections, fingerprints)):
+                if not detection.crop.size: continue
+                # crops whose fingerprint was encoded last time are not encoded again
+                if fingerprint not in encoded:
+                    encoded[fingerprint] = encoded_crops.get(fingerprint) or encode_jpeg(detection.crop)
+                attachments[f"crop_{i}"] = encoded[fingerprint]
+                described[i]["crop"] = f"crop_{i}"
+
+        fields = {"stream_id": stream_id, "frame_id": snapshot.frame_id,
+                  "capture_time": snapshot.capture_time, "detections": described}
+        key = repr(stream_id).encode('utf-8') + b''.join(sorted(fingerprints))
+        uploads.append((hashlib.blake2b(key, digest_size=8).digest(), fields, attachments))
+
+        # the keyframe is an upload of its own, so sending it never makes the detections above look new;
+        # it is offered until upload_selected hears it was picked, an upload held back for budget is retried
+        last_keyframe = keyframe_times.get(stream_id, 0)
+        if keyframe_interval and now - last_keyframe >= keyframe_interval:
+            keyframe_fields = dict(fields, detections=[{k: v for k, v in described_detection.items() if k != "crop"}
+                                                       for described_detection in described])
+            key = repr((stream_id, "keyframe", last_keyframe)).encode('utf-8')
+            uploads.append((hashlib.blake2b(key, digest_size=8).digest(), keyframe_fields,
+                            {"keyframe": encode_jpeg(snapshot.frame, CLIENT_UPLOAD_KEYFRAME_QUALITY)}))
+    encoded_crops = encoded
+    return uploads
+
+def upload_selected(fingerprint, fields, attachments):
+    """client.run_client's callback for every upload it picked to send."""
+    if "keyframe" in attachments:
+        keyframe_times[fields["stream_id"]] = time.time()
+
+def _ignore(*args):
+    pass
+
+class StreamEngine:
+    """Runs capture -> preprocess -> infer for one stream on plain threads.
+
+    Every hand-off keeps only the newest frames. Progress is reported through optional callbacks,
+    which run on the engine's threads:
+      on_result(frame_id, capture_time, frame, detections), on_status(message, color), on_error(message),
+      on_connection_failed(message) and on_connecting(busy).
+    """
+    def __init__(self, url, stream_id=0, scheduler : InferenceScheduler = None, target_fps=NEXUS_DEFAULT_FPS,
+                 on_result=None, on_status=None, on_error=None, on_connection_failed=None, on_connecting=None):
+        self.url = url
+        self.stream_id = stream_id
+        self.scheduler = scheduler
+        self.target_fps = target_fps
+        self.on_result = on_result or _ignore
+        self.on_status = on_status or _ignore
+        self.on_error = on_error or _ignore
+        self.on_connection_failed = on_connection_failed or _ignore
+        self.on_connecting = on_connecting or _ignore
+
+        self._run_flag = False
+        self.last_frame_time = 0
+        self.incoming_width = 0
+        self.incoming_height = 0
+        self.last_results = None
+        self.tracker = BoxTracker()
+        self.frames_since_detection = 0
+        self.tracking_quality = 1.0
+
+        self.cap = None
+        self.capture_thread = None
+        self.latest_frame = None
+        self.latest_frame_lock = threading.Lock()
+        self.latest_frame_cond = threading.Condition(self.latest_frame_lock)
+        self.latest_frame_id = 0
+        self.latest_frame_time = 0.0
+        self.consumed_frame_id = 0
+        self.frames_processed = 0
+        self.duplicate_frames_skipped = 0
+
+        self.pipeline_stop = threading.Event()
+        self.stage_threads : list[threading.Thread] = []
+        self.infer_queue = DropOldestQueue()
+
+    def init_video_capture(self) -> bool:
+        self.cap = open_capture(self.url)
+        if not self.cap.isOpened():
+            return False
+
+        # self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.incoming_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.incoming_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return True
+
+    def reconnect_to_camera(self) -> bool:
+        while self._run_flag:
+            self.on_connecting(True)
+            ret = self.init_video_capture()
+            self.on_connecting(False)
+            if ret:
+                return True
+            for _ in range(POST_CAMERA_RECONNECT_WAIT_ITERATIONS):
+                if not self._run_flag: return False
+                time.sleep(POST_CAMERA_RECONNECT_WAIT_INTERVAL)
+        return False
+
+    def connect_to_camera(self) -> bool:
+        self.on_connecting(True)
+        ret = self.init_video_capture()
+        self.on_connecting(False)
+        return ret
+
+    def incoming_res(self) -> str: return f"{self.incoming_width}x{self.incoming_height}"
+
+    def capture_worker(self):
+        self.on_status("Connecting...", STATUS_CONNECTING_COLOR)
+        if not self.connect_to_camera():
+            self.on_status("Disconnected", STATUS_DISCONNECTED_COLOR)
+            self.on_connection_failed(f"Failed to open {self.url}")
+            return
+        self.on_status("Connected", STATUS_CONNECTED_COLOR)
+
+        while self._run_flag:
+            if not self.cap.isOpened() or not self.cap.grab():
+                self.on_status("ReConnecting...", STATUS_CONNECTING_COLOR)
+                self.on_error("Stream lost")
+
+                with self.latest_frame_lock:
+                    self.latest_frame = None
+
+                if not NEXUS_CAMERA_AUTO_RECONNECT:
+                    break
+                else:
+                    if not self.reconnect_to_camera():
+                        break
+                    self.on_status("Connected", STATUS_CONNECTED_COLOR)
+                    continue
+
+            # grab-and-discard: while the pipeline has not taken the previous frame, converting this one is wasted work
+            if NEXUS_CAPTURE_RETRIEVE_ON_DEMAND and self.latest_frame is not None \
+                    and self.consumed_frame_id < self.latest_frame_id:
+                continue
+
+            ret, frame = self.cap.retrieve()
+            if ret:
+                with self.latest_frame_cond:
+                    self.latest_frame = frame
+                    self.latest_frame_id += 1
+                    self.latest_frame_time = time.time()
+                    self.latest_frame_cond.notify_all()
+
+        if self.cap:
+            self.cap.release()
+
+    def pipeline_running(self) -> bool:
+        return self._run_flag and not self.pipeline_stop.is_set()
+
+    def preprocess_worker(self):
+        while self.pipeline_running():
+            current_time = time.time()
+            wait_time = (1.0 / self.target_fps) - (current_time - self.last_frame_time)
+            if wait_time > 0:
+                time.sleep(min(wait_time, 0.005))
+                continue
+
+            # only genuinely new frames go on, a camera slower than target_fps just makes us wait
+            working_frame = None
+            with self.latest_frame_cond:
+                if self.latest_frame is None or self.latest_frame_id <= self.consumed_frame_id:
+                    self.duplicate_frames_skipped += 1
+                    self.latest_frame_cond.wait(NEXUS_PIPELINE_POLL_INTERVAL)
+                if self.latest_frame is not None and self.latest_frame_id > self.consumed_frame_id:
+                    working_frame = self.latest_frame.copy()
+                    frame_id, capture_time = self.latest_frame_id, self.latest_frame_time
+            if working_frame is None:
+                continue
+
+            self.consumed_frame_id = frame_id
+            self.frames_processed += 1
+            self.last_frame_time = current_time
+            self.infer_queue.put((frame_id, capture_time, working_frame, self.tracker.prepare(working_frame)))
+
+    def infer_worker(self):
+        while self.pipeline_running():
+            item = self.infer_queue.get(timeout=NEXUS_PIPELINE_POLL_INTERVAL)
+            if item is None: continue
+            frame_id, capture_time, cv_img, gray = item
+
+            if not self.scheduler:
+                update_model_classes()
+
+            # full detection every NEXUS_DETECTION_SKIP_FRAMES frames, or earlier when the tracker loses the boxes
+            # or another stream opened a detection round, so that streams detect on the same frames
+            if self.last_results is None or self.frames_since_detection + 1 >= NEXUS_DETECTION_SKIP_FRAMES \
+                    or self.tracking_quality < NEXUS_TRACKER_MIN_QUALITY \
+                    or (self.scheduler and self.scheduler.detection_due(self.stream_id)):
+                if self.scheduler:
+                    self.last_results = self.scheduler.infer(self.stream_id, cv_img)
+                else:
+                    results = predict_batch(cv_img)
+                    self.last_results = results[0]
+                self.tracker.reset(gray, self.last_results)
+                self.frames_since_detection = 0
+                self.tracking_quality = 1.0
+            else:
+                self.tracking_quality = self.tracker.update(gray)
+                self.last_results = self.tracker.results()
+                self.frames_since_detection += 1
+
+            detections = extract_detections(cv_img, self.last_results)
+            if detections is not None:
+                publish_detections(self.stream_id, DetectionSnapshot(frame_id, capture_time, cv_img, detections,
+                                                                          (self.incoming_width, self.incoming_height)))
+            self.on_result(frame_id, capture_time, cv_img, detections)
+
+    def start(self):
+        self._run_flag = True
+        if self.scheduler:
+            self.scheduler.register(self.stream_id)
+        self.pipeline_stop.clear()
+        self.capture_thread = threading.Thread(target=self.capture_worker, daemon=True)
+        self.capture_thread.start()
+        self.stage_threads = [threading.Thread(target=self.preprocess_worker, daemon=True),
+                              threading.Thread(target=self.infer_worker, daemon=True)]
+        for thread in self.stage_threads:
+            thread.start()
+
+    def running(self) -> bool:
+        """False once stop was requested or the capture gave up on the stream."""
+        return self._run_flag and self.capture_thread is not None and self.capture_thread.is_alive()
+
+    def request_stop(self):
+        self._run_flag = False
+        if self.scheduler:
+            self.scheduler.unregister(self.stream_id)
+
+    def stop(self):
+        self.request_stop()
+        self.pipeline_stop.set()
+        for thread in self.stage_threads:
+            thread.join(timeout=1.0)
+        if self.capture_thread and self.capture_thread.is_alive():
+            self.capture_thread.join(timeout=1.0)
+        self.infer_queue.clear()
+        publish_detections(self.stream_id, None)
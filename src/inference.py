@@ -0,0 +1,309 @@
+from common import *
+
+# torch and ultralytics are imported where they are first needed, importing this module stays cheap.
+
+class _StreamSlot:
+    def __init__(self):
+        self.frame = None
+        self.submitted_seq = 0
+        self.done_seq = 0
+        self.results = None
+        self.round = 0
+
+class InferenceScheduler:
+    """Collects the latest frame of every registered stream and runs them through one batched predict call.
+
+    Streams that track between detections would each detect at their own phase and end up in batches of
+    one, so detections go in rounds: a stream detecting while it is up to date opens a new round, and every
+    other stream detects on its next frame (`detection_due`) to join it. A batch waits, up to the batch
+    window, only for streams that still owe the current round.
+    """
+    def __init__(self, predict_fn, pre_batch_hook=None,
+                 max_batch_size=NEXUS_INFERENCE_MAX_BATCH, batch_window=NEXUS_INFERENCE_BATCH_WINDOW):
+        self.predict_fn = predict_fn
+        self.pre_batch_hook = pre_batch_hook
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.streams : dict = {}
+        self.round = 0
+        self.cond = threading.Condition()
+        self.thread = None
+        self._run_flag = False
+        self.batches = 0
+        self.frames = 0
+
+    def register(self, stream_id):
+        with self.cond:
+            self.streams[stream_id] = _StreamSlot()
+            self._run_flag = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+
+    def unregister(self, stream_id):
+        with self.cond:
+            self.streams.pop(stream_id, None)
+            if not self.streams:
+                self._run_flag = False
+            self.cond.notify_all()
+
+    def infer(self, stream_id, frame):
+        """Queues `frame` for the next batch and blocks until its results are ready (None on failure/unregister)."""
+        with self.cond:
+            slot : _StreamSlot = self.streams.get(stream_id)
+            if slot is None: return None
+            slot.frame = frame
+            if slot.round >= self.round:
+                self.round += 1
+            slot.round = self.round
+            slot.submitted_seq += 1
+            seq = slot.submitted_seq
+            self.cond.notify_all()
+            while self._run_flag and self.streams.get(stream_id) is slot and slot.done_seq < seq:
+                self.cond.wait()
+            return slot.results if slot.done_seq >= seq else None
+
+    def detection_due(self, stream_id):
+        """True while a detection round is open that this stream has not joined yet."""
+        with self.cond:
+            slot : _StreamSlot = self.streams.get(stream_id)
+            return slot is not None and slot.round < self.round
+
+    def _pending(self):
+        return [(sid, slot) for sid, slot in self.streams.items() if slot.frame is not None]
+
+    def _collect_batch(self):
+        with self.cond:
+            while self._run_flag and not self._pending():
+                self.cond.wait()
+            if not self._run_flag:
+                self.thread = None
+                return None
+
+            # give the streams that owe this round a short window to catch up so they share this forward pass
+            deadline = time.time() + self.batch_window
+            while self._run_flag:
+                owing = sum(1 for slot in self.streams.values() if slot.round < self.round)
+                remaining = deadline - time.time()
+                if not owing or len(self._pending()) >= self.max_batch_size or remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+
+            batch = []
+            for sid, slot in self._pending()[:self.max_batch_size]:
+                batch.append((slot, slot.submitted_seq, slot.frame))
+                slot.frame = None
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None: break
+            if not batch: continue
+
+            if self.pre_batch_hook: self.pre_batch_hook()
+            try:
+                results = self.predict_fn([frame for _, _, frame in batch])
+            except Exception as e:
+                print(f"Inference Error: {e}")
+                results = [None] * len(batch)
+
+            with self.cond:
+                for (slot, seq, _), result in zip(batch, results):
+                    slot.results = result
+                    slot.done_seq = seq
+                self.batches += 1
+                self.frames += len(batch)
+                self.cond.notify_all()
+
+def file_digest(path, _cache={}):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _cache[key] = digest.hexdigest()
+    return _cache[key]
+
+class TextEmbeddingCache:
+    """Per-class CLIP text embeddings of one model: LRU in memory, one file per class on disk.
+
+    Changing the vocabulary only runs the text encoder for classes never seen with this model file,
+    restarting with a known vocabulary runs it not at all.
+    """
+    def __init__(self, model_path, max_size=INFERENCE_EMBEDDING_CACHE_SIZE, root=INFERENCE_EMBEDDING_CACHE_DIR):
+        self.folder = os.path.join(root, file_digest(model_path)[:16])
+        self.max_size = max_size
+        self.memory : OrderedDict = OrderedDict()
+        self.encoder_calls = 0
+
+    def _path(self, name):
+        return os.path.join(self.folder, hashlib.sha1(name.encode('utf-8')).hexdigest() + '.pt')
+
+    def _get(self, name):
+        if name in self.memory:
+            self.memory.move_to_end(name)
+            return self.memory[name]
+        path = self._path(name)
+        if os.path.exists(path):
+            try:
+                import torch
+                self._put(name, torch.load(path, map_location='cpu'), persist=False)
+                return self.memory[name]
+            except Exception as e:
+                print(f"Ignoring unreadable embedding cache entry {path}: {e}")
+        return None
+
+    def _put(self, name, embedding, persist=True):
+        self.memory[name] = embedding
+        self.memory.move_to_end(name)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+        if persist:
+            import torch
+            os.makedirs(self.folder, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.folder)
+            os.close(fd)
+            torch.save(embedding, tmp)
+            os.replace(tmp, self._path(name))
+
+    def encode(self, world_model, classes):
+        """Returns the (1, len(classes), dim) text features WorldModel.set_classes would compute."""
+        import torch
+        embeddings = {name: self._get(name) for name in classes}
+        missing = [name for name, embedding in embeddings.items() if embedding is None]
+        if missing:
+            self.encoder_calls += 1
+            if hasattr(world_model, 'get_text_pe'):
+                feats = world_model.get_text_pe(missing)
+            else:
+                world_model.set_classes(missing)
+                feats = world_model.txt_feats
+            for name, embedding in zip(missing, feats.reshape(len(missing), -1).detach().cpu()):
+                embeddings[name] = embedding.clone()
+                self._put(name, embeddings[name])
+        return torch.stack([embeddings[name] for name in classes]).unsqueeze(0)
+
+class InferenceBackend:
+    """YOLO-World running in PyTorch. Also keeps the vocabulary that exported backends bake in."""
+    name = 'torch'
+
+    def __init__(self, model_path, device=INFERENCE_DEVICE, imgsz=(NEXUS_INFERENCE_WIDTH, NEXUS_INFERENCE_HEIGHT)):
+        self.model_path = model_path
+        self.device = device
+        self.imgsz = imgsz
+        self.classes : list[str] = []
+        from ultralytics import YOLO
+        self.world = YOLO(model_path)
+        self.world.to(device)
+        self.embeddings = TextEmbeddingCache(model_path)
+
+    def set_classes(self, classes):
+        self.classes = list(classes)
+        # same as YOLOWorld.set_classes, except the text features come from the cache
+        world_model = self.world.model
+        world_model.txt_feats = self.embeddings.encode(world_model, self.classes).to(next(world_model.parameters()).device)
+        world_model.model[-1].nc = len(self.classes)
+        names = [name for name in self.classes if name != " "]
+        world_model.names = names
+        if self.world.predictor:
+            self.world.predictor.model.names = names
+
+    def predict(self, frames):
+        return self.world.predict(frames, verbose=False, device=self.device, imgsz=self.imgsz)
+
+    def warmup(self, batch_sizes=None, runs=INFERENCE_WARMUP_RUNS):
+        """Runs blank frames through predict, so lazy initialisation and first-call allocations
+        happen now instead of stalling the first real frames. Call after set_classes."""
+        import numpy as np
+        if batch_sizes is None:
+            batch_sizes = sorted({1, NEXUS_INFERENCE_MAX_BATCH if NEXUS_BATCHED_INFERENCE else 1})
+        frame = np.zeros((NEXUS_INFERENCE_HEIGHT, NEXUS_INFERENCE_WIDTH, 3), dtype=np.uint8)
+        for batch_size in batch_sizes:
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                self.predict([frame] * batch_size)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"Warm-up batch {batch_size}: first {timings[0]:.0f} ms, last {timings[-1]:.0f} ms")
+
+class ExportedBackend(InferenceBackend):
+    """Runs an export of the model with the current vocabulary baked in, re-exported whenever it changes.
+    Exports are cached under INFERENCE_EXPORT_DIR keyed by model file, vocabulary and input size."""
+    export_format = None
+    export_suffix = None
+
+    def __init__(self, model_path, device=INFERENCE_DEVICE, imgsz=(NEXUS_INFERENCE_WIDTH, NEXUS_INFERENCE_HEIGHT)):
+        super().__init__(model_path, device, imgsz)
+        self.runner = None
+
+    def export_path(self):
+        stat = os.stat(self.model_path)
+        key = hashlib.sha1(json.dumps([os.path.abspath(self.model_path), stat.st_size, stat.st_mtime,
+                                       self.classes, list(self.imgsz), self.export_format]).encode('utf-8')).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(self.model_path))[0]
+        return os.path.join(INFERENCE_EXPORT_DIR, f"{stem}-{key}{self.export_suffix}")
+
+    def export(self):
+        path = self.export_path()
+        if not os.path.exists(path):
+            print(f"Exporting model to {self.export_format} for classes {self.classes}...")
+            start = time.time()
+            exported = self.world.export(format=self.export_format, imgsz=self.imgsz, dynamic=True, verbose=False)
+            os.makedirs(INFERENCE_EXPORT_DIR, exist_ok=True)
+            shutil.move(exported, path)
+            print(f"Export done in {time.time() - start:.1f}s")
+        return path
+
+    def set_classes(self, classes):
+        super().set_classes(classes)
+        try:
+            from ultralytics import YOLO
+            self.runner = YOLO(self.export(), task='detect')
+        except Exception as e:
+            # e.g. original (v1) YOLO-World checkpoints cannot be exported at all
+            print(f"{self.name} backend unavailable, falling back to torch: {e}")
+            self.runner = None
+
+    def predict(self, frames):
+        if self.runner is None:
+            return super().predict(frames)
+        return self.runner.predict(frames, verbose=False, imgsz=self.imgsz)
+
+class TorchScriptBackend(ExportedBackend):
+    name = 'torchscript'
+    export_format = 'torchscript'
+    export_suffix = '.torchscript'
+
+class OnnxBackend(ExportedBackend):
+    name = 'onnx'
+    export_format = 'onnx'
+    export_suffix = '.onnx'
+
+class OpenVinoBackend(ExportedBackend):
+    name = 'openvino'
+    export_format = 'openvino'
+    # ultralytics recognises OpenVINO exports by this directory suffix
+    export_suffix = '_openvino_model'
+
+INFERENCE_BACKENDS = {backend.name: backend for backend in (InferenceBackend, TorchScriptBackend, OnnxBackend, OpenVinoBackend)}
+
+def load_model(model_path, backend=INFERENCE_BACKEND, classes=None, warmup=INFERENCE_WARMUP) -> InferenceBackend:
+    """Loads the model; with `classes` also sets the vocabulary and, if `warmup`, runs the warm-up,
+    so the returned model answers the first real frame at steady-state speed."""
+    print("Loading model...")
+    print(f"Using device: {INFERENCE_DEVICE}, backend: {backend}")
+    start = time.perf_counter()
+    model = INFERENCE_BACKENDS[backend](model_path)
+    print(f"Model loaded in {time.perf_counter() - start:.2f}s")
+    if classes is not None:
+        start = time.perf_counter()
+        model.set_classes(classes)
+        print(f"Vocabulary set in {time.perf_counter() - start:.2f}s")
+        if warmup:
+            start = time.perf_counter()
+            model.warmup()
+            print(f"Warm-up done in {time.perf_counter() - start:.2f}s")
+    return model
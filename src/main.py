@@ -1,61 +1,22 @@
 import client
+import engine
 from common import *
-
-model : YOLO = None
-classes : list[str] = []
-command_queue : queue.Queue = queue.Queue()
-latest_detections = []
-latest_detections_lock = threading.Lock()
-
-def load_model(model_path):
-    print("Loading model...")
-    # device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
-    device = INFERENCE_DEVICE
-    print(f"Using device: {device}")
-    
-    model = YOLO(model_path)
-    model.to(device)
-    return model
-
-def detect_objects(frame, model : YOLO, classes : list[str]):
-    results = model.predict(frame, verbose=False)
-    return results[0].plot()
-
-def input_thread():
-    global command_queue
-    print("Input thread started. Enter +class to add or -class to remove (e.g., +cat, -dog).")
-    while True:
-        try:
-            user_input = input().strip()
-            command_queue.put(user_input)
-        except EOFError:
-            break
-        except Exception as e:
-            pass
-
-def update_model_classes():
-    global command_queue, classes, model
-    updated_classes = False
-    while not command_queue.empty():
-        updated_classes = True
-        command = command_queue.get()
-        try:
-            action = command[0]
-            class_name = command[1:].strip()
-            if action == '+' and class_name and class_name not in classes:
-                classes.append(class_name)
-            elif action == '-' and class_name in classes:
-                classes.remove(class_name)
-            print(f"Updated classes: {classes}")
-        except Exception as e:
-            print(f"Command Error: {e}")
-    if updated_classes:
-        target_classes = classes if classes else ['']
-        model.set_classes(target_classes)
+import cv2
+import numpy as np
+from PySide6.QtCore import Qt, Signal, QThread
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
+                               QHBoxLayout, QLabel, QLineEdit, QPushButton,
+                               QGroupBox, QFormLayout, QGridLayout)
+from inference import load_model
+from pipeline import DropOldestQueue
+from engine import StreamEngine, InferenceScheduler
 
 class VideoThread(QThread):
+    """Qt front of a StreamEngine: this thread is the render stage, the engine's callbacks become signals."""
     vt_signal_update_image = Signal(QImage)
     vt_signal_update_fps_label = Signal(str)
+    vt_signal_update_frame_stats_label = Signal(str)
     vt_signal_update_resolution_label = Signal(str, str)
     vt_signal_update_status_label = Signal(str, str)
     vt_signal_update_error_label = Signal(str)
@@ -66,170 +27,90 @@ class VideoThread(QThread):
     vt_signal_connection_failed = Signal(str)
     vt_signal_connection_retain = Signal()
     
-    def __init__(self):
+    def __init__(self, rtsp_url, stream_id=0, scheduler : InferenceScheduler = None, target_fps=NEXUS_DEFAULT_FPS):
         super().__init__()
-        self._run_flag = True
-        self.rtsp_url = ""
-        self.target_fps = NEXUS_DEFAULT_FPS
-        self.last_frame_time = 0
-        self.incoming_width = 0
-        self.incoming_height = 0
-        self.last_results = None
-        # self.frame_counter = 0
-        
-        self.cap : cv2.VideoCapture = None
-        self.capture_thread = None
-        self.latest_frame = None
-        self.latest_frame_lock = threading.Lock()
-
-    def init_video_capture(self) -> bool:
-        self.cap = cv2.VideoCapture(self.rtsp_url, cv2.CAP_FFMPEG, [
-            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, VIDEO_CAPTURE_TIMEOUT_MS,
-        ])
-        if not self.cap.isOpened():
-            return False
-
-        # self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        self.incoming_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.incoming_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        return True
-
-    def reconnect_to_camera(self) -> bool:
-        while self._run_flag:
-            self.vt_signal_disable_connect_button.emit()
-            ret = self.init_video_capture()
-            self.vt_signal_enable_connect_button.emit()
-            if ret:
-                return True
-            for _ in range(POST_CAMERA_RECONNECT_WAIT_ITERATIONS):
-                if not self._run_flag: return False
-                time.sleep(POST_CAMERA_RECONNECT_WAIT_INTERVAL)
-        return False
-    
-    def connect_to_camera(self) -> bool:
-        self.vt_signal_disable_connect_button.emit()
-        ret = self.init_video_capture()
-        self.vt_signal_enable_connect_button.emit()
-        return ret
-
-    def cvimage_to_qimage(self, cv_img : cv2.typing.MatLike) -> QImage:
-        rgb_image : cv2.typing.MatLike = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_image.shape
-        bytes_per_line = ch * w
-        convert_to_qt_format = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-        return convert_to_qt_format.scaled(NEXUS_DISPLAY_WIDTH, NEXUS_DISPLAY_HEIGHT, Qt.AspectRatioMode.KeepAspectRatio)
-
-    def incoming_res(self) -> str: return f"{self.incoming_width}x{self.incoming_height}"
-
-    def draw_detections(self, frame, results):
-        if results is None: return frame
-        with latest_detections_lock:
-            latest_detections.clear()
-
-        for box in results.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            conf = float(box.conf[0])
-            cls_id = int(box.cls[0])
-
-            try: label_name = results.names[cls_id]
-            except: label_name = ''
-            label_text = f"{label_name} {conf:.2f}"
-
-            detected_image = frame[y1:y2, x1:x2]
-            with latest_detections_lock:
-                latest_detections.append((label_name, conf, detected_image.copy()))
-
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        self.render_queue = DropOldestQueue()
+        self.engine = StreamEngine(rtsp_url, stream_id, scheduler, target_fps,
+                                   on_result=lambda *item: self.render_queue.put(item),
+                                   on_status=self.vt_signal_update_status_label.emit,
+                                   on_error=self.vt_signal_update_error_label.emit,
+                                   on_connection_failed=self.vt_signal_connection_failed.emit,
+                                   on_connecting=self.set_connecting)
+
+        # display frames are rendered into a ring of buffers that Qt reads without copying; a buffer is
+        # reused only after the GUI released it (copied it into a pixmap), otherwise the frame is dropped
+        self.render_buffers = [np.empty((NEXUS_DISPLAY_HEIGHT, NEXUS_DISPLAY_WIDTH, 3), dtype=np.uint8)
+                               for _ in range(NEXUS_RENDER_BUFFER_COUNT)]
+        self.render_index = 0
+        self.render_slots = threading.Semaphore(NEXUS_RENDER_BUFFER_COUNT)
+
+    def set_connecting(self, busy):
+        if busy: self.vt_signal_disable_connect_button.emit()
+        else: self.vt_signal_enable_connect_button.emit()
+
+    def render_display_image(self, frame, detections):
+        """Resizes `frame` once into the next free display buffer and draws the detections on it.
+        Returns a QImage over that buffer (no colour conversion, no rescale), or None if none is free."""
+        if not self.render_slots.acquire(blocking=False):
+            return None
+        display = self.render_buffers[self.render_index]
+        self.render_index = (self.render_index + 1) % NEXUS_RENDER_BUFFER_COUNT
+
+        cv2.resize(frame, (NEXUS_DISPLAY_WIDTH, NEXUS_DISPLAY_HEIGHT), dst=display)
+        self.draw_detections(frame, display, detections)
+        return QImage(display.data, NEXUS_DISPLAY_WIDTH, NEXUS_DISPLAY_HEIGHT, 3 * NEXUS_DISPLAY_WIDTH, QImage.Format.Format_BGR888)
+
+    def release_render_buffer(self):
+        self.render_slots.release()
+
+    def draw_detections(self, frame, display, detections):
+        """Draws detections, boxed in `frame` pixels, onto the display-sized `display`."""
+        if not detections: return display
+
+        h, w = frame.shape[:2]
+        sx, sy = display.shape[1] / w, display.shape[0] / h
+        display_boxes = (np.array([detection.box for detection in detections]) * np.array([sx, sy, sx, sy])).astype(int)
+
+        for (x1, y1, x2, y2), detection in zip(display_boxes, detections):
+            label_text = f"{detection.label} {detection.conf:.2f}"
+            cv2.rectangle(display, (x1, y1), (x2, y2), (0, 255, 0), 2)
             (w, h), _ = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-            cv2.rectangle(frame, (x1, y1 - 20), (x1 + w, y1), (0, 255, 0), -1)
-            cv2.putText(frame, label_text, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+            cv2.rectangle(display, (x1, y1 - 20), (x1 + w, y1), (0, 255, 0), -1)
+            cv2.putText(display, label_text, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
 
-        return frame
-
-    def capture_worker(self):
-        self.vt_signal_update_status_label.emit("Connecting...", STATUS_CONNECTING_COLOR)
-        if not self.connect_to_camera():
-            self.vt_signal_update_status_label.emit("Disconnected", STATUS_DISCONNECTED_COLOR)
-            self.vt_signal_connection_failed.emit(f"Failed to open {self.rtsp_url}")
-            return
-        self.vt_signal_update_status_label.emit("Connected", STATUS_CONNECTED_COLOR)
-
-        while self._run_flag:
-            if not self.cap.isOpened() or not self.cap.grab():
-                self.vt_signal_update_status_label.emit("ReConnecting...", STATUS_CONNECTING_COLOR)
-                self.vt_signal_update_error_label.emit("Stream lost")
-                
-                with self.latest_frame_lock:
-                    self.latest_frame = None
-
-                if not NEXUS_CAMERA_AUTO_RECONNECT:
-                    break
-                else:
-                    if not self.reconnect_to_camera():
-                        break
-                    self.vt_signal_update_status_label.emit("Connected", STATUS_CONNECTED_COLOR)
-                    continue
-            
-            ret, frame = self.cap.retrieve()
-            if ret:
-                with self.latest_frame_lock:
-                    self.latest_frame = frame
-            
-            # time.sleep(0.005) 
-
-        if self.cap:
-            self.cap.release()
+        return display
 
     def run(self):
-        global command_queue, classes, model
-
-        self.capture_thread = threading.Thread(target=self.capture_worker, daemon=True)
-        self.capture_thread.start()
-
-        while self._run_flag:
-            
-            update_model_classes()
+        self.engine.start()
+
+        last_render_time = time.time()
+        while self.engine.running():
+            item = self.render_queue.get(timeout=NEXUS_PIPELINE_POLL_INTERVAL)
+            if item is None: continue
+            frame_id, capture_time, cv_img, detections = item
+            qimage = self.render_display_image(cv_img, detections)
+            if qimage is None:
+                # the GUI still holds every buffer, it is behind, skip this frame
+                continue
 
             current_time = time.time()
-            time_diff = current_time - self.last_frame_time
-            if time_diff >= (1.0 / self.target_fps):
-                working_frame = None
-                with self.latest_frame_lock:
-                    if self.latest_frame is not None:
-                        working_frame = self.latest_frame.copy()
-                if working_frame is None:
-                    time.sleep(0.01)
-                    continue
-
-                self.last_frame_time = current_time
-                cv_img = working_frame
-
-                # self.frame_counter += 1
-                # if self.frame_counter % DETECTION_SKIP_FRAMES == 0:
-                if True:
-                    results = model.predict(cv_img, verbose=False, device=model.device, imgsz=(NEXUS_INFERENCE_WIDTH, NEXUS_INFERENCE_HEIGHT))
-                    self.last_results = results[0]
-                
-                final_img = self.draw_detections(cv_img, self.last_results)
-                final_img = cv2.resize(final_img, (NEXUS_DISPLAY_WIDTH, NEXUS_DISPLAY_HEIGHT))
-
-                qimage = self.cvimage_to_qimage(final_img)
-                self.vt_signal_update_resolution_label.emit(self.incoming_res(), f"{qimage.width()}x{qimage.height()}")
-                actual_fps = 1.0 / time_diff
-                self.vt_signal_update_fps_label.emit(f"{actual_fps:.1f}")
-                self.vt_signal_update_image.emit(qimage)
-                self.vt_signal_connection_retain.emit()
-            
-            if self.capture_thread and not self.capture_thread.is_alive():
-                break
-
-        if self.capture_thread.is_alive():
-            self.capture_thread.join(timeout=1.0)
+            actual_fps = 1.0 / max(current_time - last_render_time, 1e-6)
+            last_render_time = current_time
+            self.vt_signal_update_resolution_label.emit(self.engine.incoming_res(), f"{qimage.width()}x{qimage.height()}")
+            self.vt_signal_update_fps_label.emit(f"{actual_fps:.1f}")
+            self.vt_signal_update_frame_stats_label.emit(
+                f"#{frame_id}: {self.engine.frames_processed} new, {self.engine.duplicate_frames_skipped} dup, "
+                f"{frame_id - self.engine.frames_processed} skipped, {(current_time - capture_time) * 1000:.0f} ms")
+            self.vt_signal_update_image.emit(qimage)
+            self.vt_signal_connection_retain.emit()
+
+        self.engine.stop()
+        self.render_queue.clear()
         
         self.vt_signal_reset_ui_state.emit()
 
     def stop(self):
-        self._run_flag = False
+        self.engine.request_stop()
         self.wait()
 
 class CameraApp(QMainWindow):
@@ -245,7 +126,8 @@ class CameraApp(QMainWindow):
         self.central_widget.setLayout(self.main_layout)
 
         self._init_ui_components()
-        self.current_vt = None
+        self.video_threads : list[VideoThread] = []
+        self.finished_streams = 0
 
         self.client_thread = None
 
@@ -254,11 +136,37 @@ class CameraApp(QMainWindow):
         self._setup_controls_panel()
 
     def _setup_video_panel(self):
-        self.video_label = QLabel("Video Stream Disconnected")
-        self.video_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.video_label.setStyleSheet("background-color: black; color: white;")
-        self.video_label.setMinimumSize(NEXUS_DISPLAY_WIDTH, NEXUS_DISPLAY_HEIGHT)
-        self.main_layout.addWidget(self.video_label, stretch=2)
+        self.video_panel = QWidget()
+        self.video_grid = QGridLayout()
+        self.video_grid.setContentsMargins(0, 0, 0, 0)
+        self.video_panel.setLayout(self.video_grid)
+
+        self.video_label = self._create_video_label()
+        self.video_labels = [self.video_label]
+        self.video_grid.addWidget(self.video_label, 0, 0)
+        self.main_layout.addWidget(self.video_panel, stretch=2)
+
+    def _create_video_label(self):
+        label = QLabel("Video Stream Disconnected")
+        label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        label.setStyleSheet("background-color: black; color: white;")
+        label.setMinimumSize(NEXUS_DISPLAY_WIDTH, NEXUS_DISPLAY_HEIGHT)
+        return label
+
+    def _set_video_label_count(self, count):
+        while len(self.video_labels) > count:
+            label = self.video_labels.pop()
+            self.video_grid.removeWidget(label)
+            label.deleteLater()
+        while len(self.video_labels) < count:
+            label = self._create_video_label()
+            index = len(self.video_labels)
+            self.video_grid.addWidget(label, index // NEXUS_VIDEO_GRID_COLUMNS, index % NEXUS_VIDEO_GRID_COLUMNS)
+            self.video_labels.append(label)
+
+        columns = min(count, NEXUS_VIDEO_GRID_COLUMNS)
+        for label in self.video_labels:
+            label.setMinimumSize(NEXUS_DISPLAY_WIDTH // columns, NEXUS_DISPLAY_HEIGHT // columns)
 
     def _setup_controls_panel(self):
         self.controls_panel = QWidget()
@@ -279,7 +187,7 @@ class CameraApp(QMainWindow):
         layout = QFormLayout()
         
         self.ip_input = QLineEdit()
-        self.ip_input.setPlaceholderText("rtsp://username:passwd@IP:port")
+        self.ip_input.setPlaceholderText(f"rtsp://username:passwd@IP:port{NEXUS_STREAM_URL_SEPARATOR} ...")
         
         self.connect_btn = QPushButton("Connect")
         self.connect_btn.clicked.connect(self.toggle_connection)
@@ -344,6 +252,7 @@ class CameraApp(QMainWindow):
         self.status_label = QLabel("Disconnected")
         self.server_status_label = QLabel("Disconnected")
         self.actual_fps_label = QLabel("0")
+        self.frame_stats_label = QLabel("N/A")
         self.incoming_res_label = QLabel("N/A")
         self.display_res_label = QLabel("N/A")
         self.error_label = QLabel("None")
@@ -353,6 +262,7 @@ class CameraApp(QMainWindow):
         layout.addRow("Status:", self.status_label)
         layout.addRow("Server Status:", self.server_status_label)
         layout.addRow("Actual FPS:", self.actual_fps_label)
+        layout.addRow("Frames:", self.frame_stats_label)
         layout.addRow("Incoming Res:", self.incoming_res_label)
         layout.addRow("Displayed Res:", self.display_res_label)
         layout.addRow("Last Error:", self.error_label)
@@ -362,47 +272,62 @@ class CameraApp(QMainWindow):
 
     def reset_ui_state(self):
         self.connect_btn.setText("Connect")
+        self._set_video_label_count(1)
         self.video_label.clear()
         self.video_label.setText("Video Stream Disconnected")
         self.update_status_label("Disconnected", STATUS_DISCONNECTED_COLOR)
         self.update_resolution_label("N/A", "N/A")
         self.update_fps_label("0")
+        self.update_frame_stats_label("N/A")
 
     def _connect_stream(self):
-        rtsp_input = self.ip_input.text().strip()
-        if not rtsp_input:
+        rtsp_urls = [url.strip() for url in self.ip_input.text().split(NEXUS_STREAM_URL_SEPARATOR) if url.strip()]
+        if not rtsp_urls:
             self.reset_ui_state()
             self.update_error_label("IP Address is empty")
             return
-        
-        self.current_vt = VideoThread()
-        self.current_vt.rtsp_url = rtsp_input
-        self.current_vt.target_fps = int(self.fps) if self.fps else NEXUS_DEFAULT_FPS
-        self.current_vt.vt_signal_update_image.connect(self.update_image)
-        self.current_vt.vt_signal_update_fps_label.connect(self.update_fps_label)
-        self.current_vt.vt_signal_update_resolution_label.connect(self.update_resolution_label)
-        self.current_vt.vt_signal_update_status_label.connect(self.update_status_label)
-        self.current_vt.vt_signal_update_error_label.connect(self.update_error_label)
-        self.current_vt.vt_signal_reset_ui_state.connect(self.reset_ui_state)
-        self.current_vt.vt_signal_disable_connect_button.connect(
-            lambda: self.connect_btn.setEnabled(False)
-        )
-        self.current_vt.vt_signal_enable_connect_button.connect(
-            lambda: self.connect_btn.setEnabled(True)
-        )
-
-        self.current_vt.vt_signal_connection_failed.connect(self.handle_connection_failure)
-        self.current_vt.vt_signal_connection_retain.connect(self.handle_connection_retain)
-
-        self.current_vt.start()
+
+        # several streams share the model, so they always go through the batching scheduler
+        scheduler = engine.get_inference_scheduler() if NEXUS_BATCHED_INFERENCE or len(rtsp_urls) > 1 else None
+        self._set_video_label_count(len(rtsp_urls))
+        self.video_threads = []
+        self.finished_streams = 0
+
+        for stream_id, rtsp_url in enumerate(rtsp_urls):
+            vt = VideoThread(rtsp_url, stream_id, scheduler, int(self.fps) if self.fps else NEXUS_DEFAULT_FPS)
+
+            label = self.video_labels[stream_id]
+            vt.vt_signal_update_image.connect(lambda qimage, label=label, vt=vt: self.update_image(label, qimage, vt))
+            vt.vt_signal_update_error_label.connect(self.update_error_label)
+            vt.vt_signal_reset_ui_state.connect(lambda label=label: self.handle_stream_finished(label))
+            vt.vt_signal_disable_connect_button.connect(
+                lambda: self.connect_btn.setEnabled(False)
+            )
+            vt.vt_signal_enable_connect_button.connect(
+                lambda: self.connect_btn.setEnabled(True)
+            )
+            vt.vt_signal_connection_failed.connect(self.handle_connection_failure)
+
+            # the status panel follows the first stream
+            if stream_id == 0:
+                vt.vt_signal_update_fps_label.connect(self.update_fps_label)
+                vt.vt_signal_update_frame_stats_label.connect(self.update_frame_stats_label)
+                vt.vt_signal_update_resolution_label.connect(self.update_resolution_label)
+                vt.vt_signal_update_status_label.connect(self.update_status_label)
+                vt.vt_signal_connection_retain.connect(self.handle_connection_retain)
+            self.video_threads.append(vt)
+
+        for vt in self.video_threads:
+            vt.start()
         self.connect_btn.setText("Disconnect")
 
     def _disconnect_stream(self):
-        self.current_vt.stop()
+        for vt in self.video_threads:
+            vt.stop()
         self.reset_ui_state()
 
     def toggle_connection(self):
-        if self.current_vt and self.current_vt.isRunning():
+        if any(vt.isRunning() for vt in self.video_threads):
             self._disconnect_stream()
         else:
             self._connect_stream()
@@ -426,27 +351,20 @@ class CameraApp(QMainWindow):
             self.server_connect_btn.setText("Disconnect")
             self.update_server_status_label("Client Connected", STATUS_CONNECTED_COLOR)
 
-    def cmd_in(self, command_text : str):
-        command_queue.put(command_text.strip())
-
-    def img_out(self):
-        rets = []
-        with latest_detections_lock:
-            for label_name, conf, img in latest_detections:
-                # clear font
-                cv2.putText(img, f"{label_name} {conf:.2f}", (5, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
-                _, buffer = cv2.imencode('.jpg', img)
-                img = base64.b64encode(buffer).decode('utf-8')
-                rets.append(img)
-        return rets
-
     def client_worker(self, server_ip, server_port):            
-        client.run_client(server_ip, server_port, self.cmd_in, self.img_out)
+        client.run_client(server_ip, server_port, engine.queue_command, engine.encode_detections, engine.detections_changed,
+                          engine.upload_selected)
         self.server_connect_btn.setText("Connect")
         self.update_server_status_label("Client Disconnected", STATUS_DISCONNECTED_COLOR)
 
-    def update_image(self, cv_img):
-        self.video_label.setPixmap(QPixmap.fromImage(cv_img))
+    def update_image(self, label, cv_img, vt):
+        pixmap = QPixmap.fromImage(cv_img)
+        # the pixmap owns a copy now, the thread may render into this buffer again
+        vt.release_render_buffer()
+        if len(self.video_labels) > 1:
+            pixmap = pixmap.scaled(label.size(), Qt.AspectRatioMode.KeepAspectRatio)
+        if label in self.video_labels:
+            label.setPixmap(pixmap)
     def update_status_label(self, msg, color):
         self.status_label.setText(msg)
         self.status_label.setStyleSheet(f"color: {color}; font-weight: bold;")
@@ -460,16 +378,27 @@ class CameraApp(QMainWindow):
         self.display_res_label.setText(displayed)
     def update_fps_label(self, fps_str):
         self.actual_fps_label.setText(fps_str)
+    def update_frame_stats_label(self, stats_str):
+        self.frame_stats_label.setText(stats_str)
         
     def update_fps(self):
         text = self.fps_input.text()
         if text.isdigit() and int(text) > 0:
             self.fps = int(text)
-            if self.current_vt:
-                self.current_vt.target_fps = self.fps
+            for vt in self.video_threads:
+                vt.engine.target_fps = self.fps
+
+    def handle_stream_finished(self, label):
+        self.finished_streams += 1
+        if self.finished_streams >= len(self.video_threads):
+            self.reset_ui_state()
+        elif label in self.video_labels:
+            label.clear()
+            label.setText("Video Stream Disconnected")
 
     def handle_connection_failure(self, msg):
-        self.reset_ui_state()
+        if len(self.video_threads) <= 1:
+            self.reset_ui_state()
         self.update_error_label(msg)
 
     def handle_connection_retain(self):
@@ -477,8 +406,8 @@ class CameraApp(QMainWindow):
         pass
 
     def closeEvent(self, event):
-        if self.current_vt:
-            self.current_vt.stop()
+        for vt in self.video_threads:
+            vt.stop()
         event.accept()
 
 if __name__ == "__main__":
@@ -488,8 +417,7 @@ if __name__ == "__main__":
     if not os.path.exists(MODEL_PATH):
         print(f"Error: Model file '{MODEL_PATH}' not found.")
         sys.exit(1)
-    model = load_model(MODEL_PATH)
-    model.set_classes(classes if classes else [''])
+    engine.model = load_model(MODEL_PATH, classes=engine.classes if engine.classes else [''])
 
     app = QApplication(sys.argv)
     window = CameraApp()
@@ -0,0 +1,28 @@
+from common import *
+
+class DropOldestQueue:
+    """Bounded hand-off between pipeline stages; a full queue discards its oldest item so producers never block."""
+    def __init__(self, maxsize=NEXUS_PIPELINE_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """Returns the oldest item, or None if nothing arrived within `timeout`."""
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+            return self.items.popleft() if self.items else None
+
+    def clear(self):
+        with self.cond:
+            self.items.clear()
@@ -0,0 +1,154 @@
+from common import *
+
+# Wire format: a 4-byte big-endian length followed by a UTF-8 JSON header.
+#   v1: binary fields (e.g. "image") are base64 strings inside the JSON.
+#   v2: the header lists {"name", "size"} entries under "attachments" and the raw
+#       bytes follow the header back to back, in the same order.
+# The version is agreed with a "hello" exchange right after connecting; peers that
+# never answer the hello are spoken to in v1. A client that got the server's hello in
+# time confirms it with a "hello_ack" naming what it will speak; the server switches
+# only then, so a client that gave up waiting and stayed in v1 is never sent v2.
+# Once the client is admitted the server says so with {"type": "admitted"}; until then
+# it may not read anything the client sends.
+# Flow control: a client offering "flow_control" in its hello, answered in kind and
+# confirmed in its hello_ack, only sends responses within the credit the server grants with {"type": "credit",
+# "messages", "bytes"} messages. Grants add up; each response uses one message and its
+# attachment bytes. Sending needs a message and any positive byte credit, so bytes may
+# go into debt by one response. Other message types are never held back.
+
+def encode_message(data_dict, attachments=None, version=CS_PROTOCOL_V1) -> bytes:
+    message = dict(data_dict)
+    blobs = []
+    if attachments:
+        if version >= CS_PROTOCOL_V2:
+            message['attachments'] = [{"name": name, "size": len(blob)} for name, blob in attachments.items()]
+            blobs = list(attachments.values())
+        else:
+            for name, blob in attachments.items():
+                message[name] = base64.b64encode(blob).decode('utf-8')
+
+    json_bytes = json.dumps(message).encode('utf-8')
+    return b''.join([struct.pack('>I', len(json_bytes)), json_bytes, *blobs])
+
+class RecvBuffer:
+    """Per-connection receive buffer, grown on demand and reused for every message header."""
+    def __init__(self, size=CS_RECV_BUFFER_INITIAL_SIZE):
+        self.buffer = bytearray(size)
+
+    def recv_exact(self, sock, n):
+        """Returns a memoryview over the next `n` bytes, valid until the next call."""
+        if n > len(self.buffer):
+            self.buffer = bytearray(max(n, 2 * len(self.buffer)))
+        view = memoryview(self.buffer)[:n]
+        return view if recv_into_exact(sock, view) else None
+
+def decode_header(payload) -> dict:
+    message = json.loads(str(payload, 'utf-8'))
+    # v1 peers inline binary fields as base64, hand them out as bytes like v2 does
+    if 'attachments' not in message:
+        for name in CS_BINARY_FIELDS:
+            if isinstance(message.get(name), str):
+                message[name] = base64.b64decode(message[name])
+    return message
+
+def send_json(sock, data_dict, attachments=None, version=CS_PROTOCOL_V1):
+    try:
+        sock.sendall(encode_message(data_dict, attachments, version))
+        return True
+    except Exception as e:
+        print(f"Send Error: {e}")
+        return False
+
+def recv_json(sock, buffer : RecvBuffer = None):
+    buffer = buffer or RecvBuffer()
+    header = buffer.recv_exact(sock, CS_JSON_PROTOCOL_HEADER_SIZE)
+    if not header: return None
+    payload = buffer.recv_exact(sock, struct.unpack('>I', header)[0])
+    if not payload: return None
+    message = decode_header(payload)
+    for attachment in message.pop('attachments', []):
+        # attachments outlive the shared buffer (they are handed to other threads),
+        # so each one lands in its own exactly-sized bytearray instead
+        blob = recv_all(sock, attachment['size'])
+        if blob is None: return None
+        message[attachment['name']] = blob
+    return message
+
+async def recv_json_async(reader : asyncio.StreamReader):
+    try:
+        header = await reader.readexactly(CS_JSON_PROTOCOL_HEADER_SIZE)
+        return await recv_body_async(reader, header)
+    except asyncio.IncompleteReadError:
+        return None
+
+async def recv_body_async(reader : asyncio.StreamReader, header, max_size=None):
+    """The rest of a message whose length prefix `header` was already read. With `max_size`, a message
+    declaring more than that in header and attachments raises ValueError before its bytes are read."""
+    length = struct.unpack('>I', header)[0]
+    if max_size is not None and length > max_size:
+        raise ValueError(f"message of {length} bytes exceeds {max_size}")
+    message = decode_header(await reader.readexactly(length))
+    attachments = message.pop('attachments', [])
+    if max_size is not None and length + sum(attachment['size'] for attachment in attachments) > max_size:
+        raise ValueError(f"attachments exceed {max_size} bytes")
+    for attachment in attachments:
+        message[attachment['name']] = await reader.readexactly(attachment['size'])
+    return message
+
+def recv_into_exact(sock, view) -> bool:
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count: return False
+        received += count
+    return True
+
+def recv_all(sock, n):
+    data = bytearray(n)
+    return data if recv_into_exact(sock, memoryview(data)) else None
+
+def hello_message(version=CS_PROTOCOL_VERSION, flow_control=False):
+    message = {"type": "hello", "protocol": version}
+    if flow_control: message["flow_control"] = True
+    return message
+
+def hello_ack_message(version, flow_control=False):
+    message = {"type": "hello_ack", "protocol": version}
+    if flow_control: message["flow_control"] = True
+    return message
+
+def admitted_message():
+    return {"type": "admitted"}
+
+def credit_message(messages, size):
+    return {"type": "credit", "messages": messages, "bytes": size}
+
+def attachments_size(attachments):
+    return sum(len(blob) for blob in attachments.values()) if attachments else 0
+
+def negotiate_protocol(sock, buffer : RecvBuffer = None):
+    """Client side of the hello exchange. Returns (version, flow_control, message) where message is
+    anything other than the hello reply that arrived while waiting (legacy servers)."""
+    if not send_json(sock, hello_message(flow_control=CS_FLOW_CONTROL)):
+        return CS_PROTOCOL_V1, False, None
+
+    previous_timeout = sock.gettimeout()
+    sock.settimeout(CS_PROTOCOL_NEGOTIATION_TIMEOUT)
+    try:
+        reply = recv_json(sock, buffer)
+    except (socket.timeout, TimeoutError):
+        return CS_PROTOCOL_V1, False, None
+    finally:
+        sock.settimeout(previous_timeout)
+
+    if reply and reply.get('type') == 'hello':
+        flow_control = CS_FLOW_CONTROL and bool(reply.get('flow_control'))
+        version = min(int(reply.get('protocol', CS_PROTOCOL_V1)), CS_PROTOCOL_VERSION)
+        if not send_json(sock, hello_ack_message(version, flow_control)):
+            return CS_PROTOCOL_V1, False, None
+        return version, flow_control, None
+    return CS_PROTOCOL_V1, False, reply
+
+def hello_version(message):
+    """Server side of the hello exchange, returns the version to speak with this client."""
+    return max(CS_PROTOCOL_V1, min(int(message.get('protocol', CS_PROTOCOL_V1)), CS_PROTOCOL_VERSION))
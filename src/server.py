@@ -1,4 +1,23 @@
 from common import *
+from PySide6.QtCore import Qt, Signal, QObject, Slot, QTimer, QRunnable, QThreadPool, QDateTime
+from PySide6.QtGui import QImage, QPixmap, QTextCursor, QColor
+from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
+                               QHBoxLayout, QLabel, QLineEdit, QPushButton,
+                               QListWidget, QTextEdit, QSplitter, QGroupBox,
+                               QMessageBox, QListWidgetItem, QMenu, QCheckBox, QFormLayout,
+                               QDialog, QComboBox, QDateTimeEdit)
+from protocol import encode_message, recv_json_async, recv_body_async, hello_message, admitted_message, hello_version, credit_message, attachments_size
+from storage import SegmentStore, StoreReader, RecordRef, split_attachments
+
+def display_image(blobs):
+    """The attachment worth showing for a response: keyframe, else the first crop, else a legacy image."""
+    for name in ('keyframe', 'crop_0', 'image'):
+        if blobs.get(name):
+            return blobs[name]
+    return next((blob for blob in blobs.values() if blob), b'')
+
+def describe_detections(meta):
+    return ', '.join(f"{detection.get('class', '?')} {detection.get('conf', 0):.2f}" for detection in meta.get('detections', []))
 
 class ClientListWidget(QWidget):
     def __init__(self, text):
@@ -59,131 +78,530 @@ class ClientListWidget(QWidget):
     def set_checked(self, state):
         self.checkbox.setChecked(state)
 
-def send_json(sock, data_dict):
-    try:
-        json_bytes = json.dumps(data_dict).encode('utf-8')
-        message = struct.pack('>I', len(json_bytes)) + json_bytes
-        sock.sendall(message)
-    except Exception as e:
-        print(f"Send Error: {e}")
-
-def recv_json(sock):
-    try:
-        raw_len = recv_all(sock, CS_JSON_PROTOCOL_HEADER_SIZE)
-        if not raw_len: return None
-        msg_len = struct.unpack('>I', raw_len)[0]
-        
-        payload = recv_all(sock, msg_len)
-        if not payload: return None
-        return json.loads(payload.decode('utf-8'))
-    except Exception:
-        return None
-
-def recv_all(sock, n):
-    data = b''
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet: return None
-        data += packet
-    return data
+class DecodeSignals(QObject):
+    decoded = Signal(int, str, str, object)
+
+class ImageDecodeTask(QRunnable):
+    """Decodes a received image and scales it to the monitor size off the GUI thread."""
+    def __init__(self, signals : DecodeSignals, generation, ip, ts, img_data, size):
+        super().__init__()
+        self.signals = signals
+        self.generation = generation
+        self.ip = ip
+        self.ts = ts
+        self.img_data = img_data
+        self.size = size
+
+    def run(self):
+        qimg = QImage.fromData(self.img_data)
+        if not qimg.isNull():
+            qimg = qimg.scaled(self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.signals.decoded.emit(self.generation, self.ip, self.ts, qimg)
+
+class StorageBrowser(QDialog):
+    """Pages through stored responses, only the selected record's image is loaded."""
+    ALL_CLIENTS = "All clients"
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Stored Responses")
+        self.resize(900, 600)
+        self.reader = StoreReader()
+        self.page = 0
+        self.total = 0
+        self.refs : list[RecordRef] = []
+
+        layout = QHBoxLayout(self)
+        left_layout = QVBoxLayout()
+        form = QFormLayout()
+
+        self.cmb_client = QComboBox()
+        self.cmb_client.addItem(self.ALL_CLIENTS)
+        self.cmb_client.addItems(self.reader.clients())
+
+        now = QDateTime.currentDateTime()
+        self.chk_range = QCheckBox("Filter by time")
+        self.dt_start = QDateTimeEdit(now.addSecs(-3600))
+        self.dt_end = QDateTimeEdit(now)
+        for dt in (self.dt_start, self.dt_end):
+            dt.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
+            dt.setCalendarPopup(True)
+
+        btn_search = QPushButton("Search")
+        form.addRow("Client:", self.cmb_client)
+        form.addRow(self.chk_range)
+        form.addRow("From:", self.dt_start)
+        form.addRow("To:", self.dt_end)
+        form.addRow(btn_search)
+
+        self.list_records = QListWidget()
+        paging_layout = QHBoxLayout()
+        self.btn_prev = QPushButton("< Newer")
+        self.btn_next = QPushButton("Older >")
+        self.lbl_page = QLabel("")
+        paging_layout.addWidget(self.btn_prev)
+        paging_layout.addWidget(self.lbl_page, 1, Qt.AlignCenter)
+        paging_layout.addWidget(self.btn_next)
+
+        left_layout.addLayout(form)
+        left_layout.addWidget(self.list_records, 1)
+        left_layout.addLayout(paging_layout)
+
+        right_layout = QVBoxLayout()
+        self.lbl_image = QLabel("No Record Selected")
+        self.lbl_image.setAlignment(Qt.AlignCenter)
+        self.lbl_image.setStyleSheet("border: 1px dashed gray; background: #eee;")
+        self.lbl_image.setMinimumSize(400, 300)
+        self.txt_meta = QTextEdit()
+        self.txt_meta.setReadOnly(True)
+        right_layout.addWidget(self.lbl_image, 1)
+        right_layout.addWidget(self.txt_meta)
+
+        layout.addLayout(left_layout, 1)
+        layout.addLayout(right_layout, 2)
+
+        btn_search.clicked.connect(self.search)
+        self.btn_prev.clicked.connect(lambda: self.load_page(self.page - 1))
+        self.btn_next.clicked.connect(lambda: self.load_page(self.page + 1))
+        self.list_records.currentRowChanged.connect(self.show_record)
+        self.search()
+
+    def query_args(self):
+        client = self.cmb_client.currentText()
+        clients = None if client == self.ALL_CLIENTS else [client]
+        if not self.chk_range.isChecked():
+            return clients, None, None
+        return clients, self.dt_start.dateTime().toSecsSinceEpoch(), self.dt_end.dateTime().toSecsSinceEpoch()
+
+    def search(self):
+        clients, start, end = self.query_args()
+        self.total = self.reader.count(clients, start, end)
+        self.load_page(0)
+
+    def load_page(self, page):
+        page_count = max(1, -(-self.total // SERVER_BROWSE_PAGE_SIZE))
+        self.page = min(max(page, 0), page_count - 1)
+        clients, start, end = self.query_args()
+        self.refs = self.reader.query(clients, start, end, skip=self.page * SERVER_BROWSE_PAGE_SIZE)
+
+        self.list_records.clear()
+        for ref in self.refs:
+            ts = datetime.fromtimestamp(ref.received_at).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+            self.list_records.addItem(f"[{ts}] {ref.client}")
+        self.lbl_page.setText(f"Page {self.page + 1} of {page_count} ({self.total} records)")
+        self.btn_prev.setEnabled(self.page > 0)
+        self.btn_next.setEnabled(self.page < page_count - 1)
+
+    def show_record(self, row):
+        if row < 0 or row >= len(self.refs): return
+        try:
+            meta, data = self.reader.read(self.refs[row])
+        except Exception as e:
+            self.txt_meta.setText(f"Failed to read record: {e}")
+            return
+        self.txt_meta.setText(json.dumps(meta, indent=2))
+        qimg = QImage.fromData(display_image(split_attachments(meta, data)))
+        if qimg.isNull():
+            self.lbl_image.setText("No Image")
+        else:
+            self.lbl_image.setPixmap(QPixmap.fromImage(qimg).scaled(self.lbl_image.size(), Qt.KeepAspectRatio))
 
 class ServerSignals(QObject):
     log = Signal(str)
     client_connected = Signal(str, object)
     client_disconnected = Signal(str)
-    image_received = Signal(str, str, str, str)
     request_access = Signal(str, object)
 
+class DisplayCoalescer:
+    """Keeps only the newest undisplayed frame per client, the GUI drains it at its own repaint rate."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.stats = {}
+
+    def put(self, ip_id, ts, img_data, meta):
+        with self.lock:
+            stats = self.stats.setdefault(ip_id, {'received': 0, 'displayed': 0, 'dropped': 0})
+            stats['received'] += 1
+            if self.slots.pop(ip_id, None) is not None:
+                stats['dropped'] += 1
+            self.slots[ip_id] = (ts, img_data, meta)
+
+    def take(self):
+        """Returns {ip_id: (ts, img_data, meta)}, ordered from oldest to newest arrival."""
+        with self.lock:
+            frames, self.slots = self.slots, {}
+            for ip_id in frames:
+                self.stats[ip_id]['displayed'] += 1
+            return frames
+
+    def get_stats(self, ip_id):
+        with self.lock:
+            return dict(self.stats.get(ip_id, {'received': 0, 'displayed': 0, 'dropped': 0}))
+
+    def remove(self, ip_id):
+        with self.lock:
+            self.slots.pop(ip_id, None)
+            self.stats.pop(ip_id, None)
+
+class CreditPolicy:
+    """Flow control: how much a client may have in flight, and whether credit for the responses the
+    server has processed is handed back now. Under load low priorities are held back first."""
+    def __init__(self, priorities=SERVER_CLIENT_PRIORITIES, window_messages=SERVER_CREDIT_WINDOW_MESSAGES,
+                 window_bytes=SERVER_CREDIT_WINDOW_BYTES, throttle_load=SERVER_CREDIT_THROTTLE_LOAD):
+        self.priorities = dict(priorities)
+        self.window_messages = window_messages
+        self.window_bytes = window_bytes
+        self.throttle_load = dict(throttle_load)
+
+    def priority(self, host):
+        return self.priorities.get(host, 'normal')
+
+    def may_refill(self, priority, load):
+        return load < self.throttle_load.get(priority, self.throttle_load['normal'])
+
+    def refill_due(self, owed_messages, owed_bytes):
+        """Credit goes back in batches of half a window, the refill timer returns the remainder."""
+        return owed_messages >= max(1, self.window_messages // 2) or owed_bytes >= self.window_bytes // 2
+
+ADMISSION_ACCEPT = 'accept'
+ADMISSION_REJECT = 'reject'
+ADMISSION_ASK = 'ask'
+
+class AdmissionPolicy:
+    """Decides which connections are let in without asking the operator."""
+    def __init__(self, allowlist=SERVER_ADMISSION_ALLOWLIST, denylist=SERVER_ADMISSION_DENYLIST,
+                 fingerprints=SERVER_ADMISSION_FINGERPRINTS, readmit_seconds=SERVER_ADMISSION_READMIT_SECONDS,
+                 auto_accept=SERVER_ADMISSION_AUTO_ACCEPT):
+        self.allowed_networks = [ipaddress.ip_network(net, strict=False) for net in allowlist]
+        self.denied_networks = [ipaddress.ip_network(net, strict=False) for net in denylist]
+        self.fingerprints = {normalize_fingerprint(fp) for fp in fingerprints}
+        self.readmit_seconds = readmit_seconds
+        self.auto_accept = auto_accept
+        self.recently_admitted = {}
+        self.lock = threading.Lock()
+
+    def allow(self, host):
+        with self.lock:
+            self.allowed_networks.append(ipaddress.ip_network(host))
+
+    def remember(self, host):
+        with self.lock:
+            self.recently_admitted[host] = time.time()
+
+    def evaluate(self, host, fingerprint=None):
+        try: address = ipaddress.ip_address(host)
+        except ValueError: return ADMISSION_ASK
+        with self.lock:
+            if any(address in net for net in self.denied_networks):
+                return ADMISSION_REJECT
+            if self.auto_accept or any(address in net for net in self.allowed_networks):
+                return ADMISSION_ACCEPT
+            if fingerprint and fingerprint in self.fingerprints:
+                return ADMISSION_ACCEPT
+            # clients coming back after a network blip do not need to be approved again
+            if time.time() - self.recently_admitted.get(host, 0) <= self.readmit_seconds:
+                return ADMISSION_ACCEPT
+        return ADMISSION_ASK
+
+def normalize_fingerprint(fingerprint):
+    return fingerprint.replace(':', '').lower()
+
+def peer_fingerprint(writer : asyncio.StreamWriter):
+    ssl_object = writer.get_extra_info('ssl_object')
+    cert = ssl_object.getpeercert(binary_form=True) if ssl_object else None
+    return hashlib.sha256(cert).hexdigest() if cert else None
+
+class AdmissionTicket:
+    """A connection waiting for the operator, resolved from the GUI thread."""
+    def __init__(self, ip_id, host, fingerprint, loop):
+        self.ip_id = ip_id
+        self.host = host
+        self.fingerprint = fingerprint
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def is_pending(self):
+        return not self.future.done()
+
+    def resolve(self, accepted):
+        self.loop.call_soon_threadsafe(self._set_result, accepted)
+
+    def _set_result(self, accepted):
+        if not self.future.done():
+            self.future.set_result(accepted)
+
+class ClientConnection:
+    """One accepted client, owned by the server's event loop.
+
+    Outgoing messages go through a bounded queue drained by the connection's own writer task,
+    so a slow client only ever delays itself. `on_done(error)` of a message is called on the
+    loop once it was handed to the socket (error None) or given up on.
+    """
+    def __init__(self, ip_id, reader : asyncio.StreamReader, writer : asyncio.StreamWriter, loop):
+        self.ip_id = ip_id
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.protocol_version = CS_PROTOCOL_V1
+        self.queue : asyncio.Queue = asyncio.Queue(maxsize=SERVER_CLIENT_WRITE_QUEUE_SIZE)
+        self.writer_task : asyncio.Task = None
+        # flow control, see protocol.py: credit used up by responses the server has processed
+        self.flow_control = False
+        self.priority = 'normal'
+        self.owed_messages = 0
+        self.owed_bytes = 0
+        self.throttled = False
+
+    def grant(self, messages, size):
+        """Event loop thread only, returns whether the credit was queued."""
+        return self.send(credit_message(messages, size))
+
+    def start(self):
+        self.writer_task = self.loop.create_task(self._writer_loop())
+
+    def send(self, data_dict, attachments=None, on_done=None):
+        """Event loop thread only. Never waits; a full queue fails the message right away.
+        Returns whether the message was queued."""
+        try:
+            self.queue.put_nowait((data_dict, attachments, on_done))
+            return True
+        except asyncio.QueueFull:
+            if on_done: on_done(ConnectionError(f"write queue of {self.ip_id} is full"))
+            return False
+
+    def send_threadsafe(self, data_dict, attachments=None, on_done=None):
+        self.loop.call_soon_threadsafe(self.send, data_dict, attachments, on_done)
+
+    async def _writer_loop(self):
+        while True:
+            data_dict, attachments, on_done = await self.queue.get()
+            try:
+                self.writer.write(encode_message(data_dict, attachments, self.protocol_version))
+                await asyncio.wait_for(self.writer.drain(), SERVER_SEND_TIMEOUT)
+            except asyncio.CancelledError:
+                # stop() while this one was in flight, it is given up on like the queued ones
+                if on_done: on_done(ConnectionError(f"{self.ip_id} disconnected"))
+                raise
+            except Exception as e:
+                if on_done: on_done(e if str(e) else TimeoutError("send timed out"))
+                # a client that stopped reading would stall every message behind this one
+                self.writer.close()
+                return
+            if on_done: on_done(None)
+
+    def stop(self):
+        """Event loop thread only: ends the writer and fails whatever is still queued."""
+        if self.writer_task:
+            self.writer_task.cancel()
+        while not self.queue.empty():
+            _, _, on_done = self.queue.get_nowait()
+            if on_done: on_done(ConnectionError(f"{self.ip_id} disconnected"))
+
+    def close(self):
+        """Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self.writer.close)
+
 class NetworkServer(QObject):
     def __init__(self, port=SERVER_PORT):
         super().__init__()
         self.port = port
         self.running = False
-        self.server_socket = None
+        self.server = None
+        self.loop : asyncio.AbstractEventLoop = None
         self.signals = ServerSignals()
-        self.clients = {}
+        self.display = DisplayCoalescer()
+        self.storage = SegmentStore() if SERVER_STORAGE_ENABLED else None
+        self.clients : dict[str, ClientConnection] = {}
         self.client_history = {}
-        self.allow_connection = False
+        self.admission_policy = AdmissionPolicy()
+        self.credit_policy = CreditPolicy()
 
     def start_server(self):
         self.running = True
-        threading.Thread(target=self._listen_loop, daemon=True).start()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self._run_loop, daemon=True).start()
 
-    def _listen_loop(self):
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
         try:
-            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            context.load_cert_chain(certfile=SERVER_CERT_PATH, keyfile=SERVER_KEY_PATH)
-
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.bind((SERVER_BIND_IP, self.port))
-
-            self.server_socket = context.wrap_socket(self.server_socket, server_side=True)
-
-            self.server_socket.listen(SERVER_BACKLOG)
-            self.signals.log.emit(f"Server listening on port {self.port}")
-
-            while self.running:
-                client_sock, addr = self.server_socket.accept()
-                ip_id = f"{addr[0]}:{addr[1]}"
-
-                self.allow_connection = False
-                wait_event = threading.Event()
-                self.signals.request_access.emit(ip_id, wait_event)
-                wait_event.wait()
-
-                if not self.allow_connection:
-                    self.signals.log.emit(f"Rejected connection from {ip_id}")
-                    client_sock.close()
-                    continue
-
-                self.clients[ip_id] = client_sock
-                self.client_history[ip_id] = []
-                self.signals.client_connected.emit(ip_id, client_sock)
-                self.signals.log.emit(f"New connection: {ip_id}")
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            self.signals.log.emit(f"Server Error: {e}")
 
-                threading.Thread(target=self._handle_client, args=(client_sock, ip_id), daemon=True).start()
+    async def _serve(self):
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(certfile=SERVER_CERT_PATH, keyfile=SERVER_KEY_PATH)
+        if os.path.exists(SERVER_CLIENT_CA_PATH):
+            # client certificates are optional, they only feed the fingerprint allowlist
+            context.load_verify_locations(SERVER_CLIENT_CA_PATH)
+            context.verify_mode = ssl.CERT_OPTIONAL
+
+        self.server = await asyncio.start_server(self._handle_client, SERVER_BIND_IP, self.port,
+                                                 ssl=context, backlog=SERVER_BACKLOG,
+                                                 ssl_handshake_timeout=SERVER_SSL_HANDSHAKE_TIMEOUT)
+        self.signals.log.emit(f"Server listening on port {self.port}")
+        refill_task = self.loop.create_task(self._refill_loop())
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            refill_task.cancel()
+
+    def load(self):
+        """0 when idle, 1 when the slowest consumer of responses (the storage writer) is full."""
+        if not self.storage: return 0.0
+        return self.storage.queue.qsize() / max(1, self.storage.queue.maxsize)
+
+    def _refill(self, conn : ClientConnection, force=False):
+        if not conn.owed_messages and not conn.owed_bytes: return
+        if not force and not self.credit_policy.refill_due(conn.owed_messages, conn.owed_bytes): return
+        if not self.credit_policy.may_refill(conn.priority, self.load()):
+            if not conn.throttled:
+                conn.throttled = True
+                self.signals.log.emit(f"Throttling {conn.priority} priority client {conn.ip_id}")
+            return
+        if conn.throttled:
+            conn.throttled = False
+            self.signals.log.emit(f"Resuming client {conn.ip_id}")
+        # credit that did not fit in the write queue stays owed, the refill timer tries again
+        if conn.grant(conn.owed_messages, conn.owed_bytes):
+            conn.owed_messages = conn.owed_bytes = 0
+
+    async def _refill_loop(self):
+        # hands back credit below the batching threshold, and that of clients held back while the load was high
+        while True:
+            await asyncio.sleep(SERVER_CREDIT_REFILL_INTERVAL)
+            for conn in list(self.clients.values()):
+                if conn.flow_control:
+                    self._refill(conn, force=True)
+
+    async def _admit(self, ip_id, host, fingerprint, decision):
+        if decision != ADMISSION_ASK:
+            self.signals.log.emit(f"Auto-{decision} connection from {ip_id}")
+            accepted = decision == ADMISSION_ACCEPT
+        else:
+            # only this connection waits for the operator, accepting carries on meanwhile
+            ticket = AdmissionTicket(ip_id, host, fingerprint, self.loop)
+            self.signals.request_access.emit(ip_id, ticket)
+            try:
+                accepted = await asyncio.wait_for(ticket.future, SERVER_ADMISSION_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self.signals.log.emit(f"Admission of {ip_id} timed out")
+                accepted = False
+
+        if accepted:
+            self.admission_policy.remember(host)
+        return accepted
+
+    def _answer_hello(self, conn : ClientConnection, message):
+        # only an offer: the connection switches once the client acknowledges it (hello_ack)
+        conn.send(hello_message(hello_version(message), CS_FLOW_CONTROL and bool(message.get('flow_control'))))
+
+    async def _greet(self, conn : ClientConnection):
+        """Answers the hello before admission, which may wait for the operator far longer than the client
+        waits for the reply. Returns the first message when it was something else (legacy clients).
+        Nothing is admitted yet, so the message is size-capped and must arrive in time as a whole."""
+        try:
+            # waiting for the length prefix consumes nothing, a client that says nothing yet stays usable
+            header = await asyncio.wait_for(conn.reader.readexactly(CS_JSON_PROTOCOL_HEADER_SIZE), SERVER_HELLO_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("closed before admission")
+        try:
+            message = await asyncio.wait_for(recv_body_async(conn.reader, header, SERVER_FIRST_MESSAGE_MAX_SIZE),
+                                             SERVER_FIRST_MESSAGE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"first message incomplete after {SERVER_FIRST_MESSAGE_TIMEOUT} s")
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("closed before admission")
+        if message.get('type') == 'hello':
+            self._answer_hello(conn, message)
+            return None
+        return message
+
+    async def _handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        ip_id = f"{addr[0]}:{addr[1]}"
+
+        # denied peers are turned away before a single byte of theirs is read
+        decision = self.admission_policy.evaluate(addr[0], peer_fingerprint(writer))
+        if decision == ADMISSION_REJECT:
+            self.signals.log.emit(f"Rejected connection from {ip_id}")
+            writer.close()
+            return
 
+        conn = ClientConnection(ip_id, reader, writer, self.loop)
+        conn.start()
+        try:
+            first = await self._greet(conn)
+            accepted = await self._admit(ip_id, addr[0], peer_fingerprint(writer), decision)
         except Exception as e:
-            self.signals.log.emit(f"Server Error: {e}")
+            self.signals.log.emit(f"Client {ip_id} error: {e}")
+            accepted = False
+        if not accepted:
+            self.signals.log.emit(f"Rejected connection from {ip_id}")
+            conn.stop()
+            writer.close()
+            return
+
+        self.clients[ip_id] = conn
+        self.client_history[ip_id] = []
+        self.signals.client_connected.emit(ip_id, conn)
+        self.signals.log.emit(f"New connection: {ip_id}")
+        conn.send(admitted_message())
 
-    def _handle_client(self, conn, ip_id):
         try:
             while self.running:
-                data = recv_json(conn)
+                data = first or await recv_json_async(reader)
+                first = None
                 if not data:
                     break
                 
-                if data.get('type') == 'response':
-                    img_b64 = data.get('image', '')
+                if data.get('type') == 'hello':
+                    self._answer_hello(conn, data)
+                elif data.get('type') == 'hello_ack':
+                    conn.protocol_version = hello_version(data)
+                    # credit is only counted for a client that confirmed it waits for it
+                    conn.flow_control = CS_FLOW_CONTROL and bool(data.get('flow_control'))
+                    if conn.flow_control:
+                        conn.priority = self.credit_policy.priority(addr[0])
+                        conn.owed_messages += self.credit_policy.window_messages
+                        conn.owed_bytes += self.credit_policy.window_bytes
+                        self._refill(conn, force=True)
+                    self.signals.log.emit(f"Client {ip_id} speaks protocol v{conn.protocol_version}"
+                                          + (f" with flow control, {conn.priority} priority" if conn.flow_control else ""))
+                elif data.get('type') == 'response':
                     ts = data.get('timestamp', '')
-                    client_ip = data.get('client_ip', '')
-                    
-                    if False: self._save_data(client_ip, ts, img_b64)
-                    self.signals.image_received.emit(ip_id, ts, img_b64, json.dumps(data, indent=2))
+
+                    # detections are plain metadata, images (crops, keyframe, legacy "image") are optional
+                    blobs = {k: v for k, v in data.items() if isinstance(v, (bytes, bytearray))}
+                    meta = {k: v for k, v in data.items() if k not in blobs}
+                    if blobs:
+                        meta['attachments'] = [{"name": name, "size": len(blob)} for name, blob in blobs.items()]
+                    # stored per peer host: the self-reported client_ip is not unique, it only stays in the meta
+                    if self.storage: self.storage.append(addr[0], meta, b''.join(blobs.values()))
+                    self.display.put(ip_id, ts, display_image(blobs), meta)
+                    if conn.flow_control:
+                        conn.owed_messages += 1
+                        conn.owed_bytes += attachments_size(blobs)
+                        self._refill(conn)
         except Exception as e:
             self.signals.log.emit(f"Client {ip_id} error: {e}")
         finally:
-            try: conn.close()
-            except: pass
+            conn.stop()
+            writer.close()
             if ip_id in self.clients: del self.clients[ip_id]
             if ip_id in self.client_history: del self.client_history[ip_id]
+            self.display.remove(ip_id)
             self.signals.client_disconnected.emit(ip_id)
             self.signals.log.emit(f"Client disconnected: {ip_id}")
 
-    def _save_data(self, client_ip, timestamp, img_b64):
-        try:
-            clean_ip = client_ip.replace(':', '_')
-            folder = os.path.join("received_data", clean_ip)
-            os.makedirs(folder, exist_ok=True)
-            
-            filename = f"{timestamp.replace(':','-')}.png"
-            path = os.path.join(folder, filename)
-            
-            img_data = base64.b64decode(img_b64)
-            with open(path, "wb") as f:
-                f.write(img_data)
-        except Exception as e:
-            print(f"Failed to save data: {e}")
+    def stop_server(self):
+        self.running = False
+        if self.storage:
+            self.storage.close()
 
     def _add_to_history(self, client_id, command):
         if client_id not in self.client_history:
@@ -197,29 +615,74 @@ class NetworkServer(QObject):
             self.client_history[client_id].pop(0)
 
     def send_command(self, target_ip, command):
+        self.broadcast([target_ip], command)
+
+    def broadcast(self, target_ips, command):
+        """Queues `command` to every target and returns at once. Each client's writer sends it concurrently,
+        results are logged per client as they come in and summed up once all are done."""
         payload = {"type": "query", "command": command}
-        
-        if target_ip in self.clients:
-            try:
-                send_json(self.clients[target_ip], payload)
-                self._add_to_history(target_ip, command)
+        if not self.loop:
+            self.signals.log.emit("Send failed: server is not running")
+            return
+        self.loop.call_soon_threadsafe(self._broadcast, list(target_ips), command, payload)
+
+    def _broadcast(self, target_ips, command, payload):
+        start = time.perf_counter()
+        remaining = len(target_ips)
+        failed = 0
+
+        def done(target_ip, error):
+            nonlocal remaining, failed
+            remaining -= 1
+            if error is None:
                 self.signals.log.emit(f"Sent to {target_ip}: {command}")
-            except Exception as e:
-                self.signals.log.emit(f"Send failed: {e}")
-        else:
-            self.signals.log.emit(f"Target {target_ip} not found.")
+            else:
+                failed += 1
+                self.signals.log.emit(f"Send to {target_ip} failed: {error}")
+            if remaining == 0 and len(target_ips) > 1:
+                self.signals.log.emit(f"Broadcast to {len(target_ips)} clients done in "
+                                      f"{(time.perf_counter() - start) * 1000:.0f} ms, {failed} failed")
+
+        for target_ip in target_ips:
+            conn = self.clients.get(target_ip)
+            if conn is None:
+                done(target_ip, LookupError("not connected"))
+                continue
+            self._add_to_history(target_ip, command)
+            conn.send(payload, on_done=lambda error, target_ip=target_ip: done(target_ip, error))
 
 class ServerGUI(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Distributed Control Server")
         self.resize(1000, 750)
+        self.pending_admissions : deque[AdmissionTicket] = deque()
+        self.admission_prompt_open = False
+        # ip_id -> time of its last displayed response, alerts are only logged when a client starts responding
+        self.last_response_time : dict[str, float] = {}
+
+        self.decode_pool = QThreadPool(self)
+        self.decode_pool.setMaxThreadCount(SERVER_DECODE_POOL_SIZE)
+        self.decode_signals = DecodeSignals()
+        self.decode_signals.decoded.connect(self.on_image_decoded)
+        self.decode_generation = 0
+        self.painted_generation = 0
+        self.decodes_in_flight = 0
+        self.pending_decode = None
         
         self.server = NetworkServer()
         self.setup_ui()
         self.connect_signals()
         self.server.start_server()
 
+        self.display_timer = QTimer(self)
+        self.display_timer.timeout.connect(self.refresh_display)
+        self.display_timer.start(int(1000 / SERVER_DISPLAY_MAX_FPS))
+
+    def closeEvent(self, event):
+        self.server.stop_server()
+        event.accept()
+
     def setup_ui(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -277,8 +740,12 @@ class ServerGUI(QMainWindow):
         self.lbl_meta = QLabel("Metadata: Waiting...")
         self.lbl_meta.setWordWrap(True)
         
+        btn_browse = QPushButton("Browse Stored Responses")
+        btn_browse.setEnabled(SERVER_STORAGE_ENABLED)
+
         disp_layout.addWidget(self.lbl_image, 1)
         disp_layout.addWidget(self.lbl_meta)
+        disp_layout.addWidget(btn_browse)
         grp_display.setLayout(disp_layout)
         
         right_layout.addWidget(grp_display)
@@ -299,23 +766,49 @@ class ServerGUI(QMainWindow):
         btn_select_all.clicked.connect(self.on_select_all_clicked)
         btn_unselect_all.clicked.connect(self.on_unselect_all_clicked)
         remove_selected_btn.clicked.connect(self.remove_client)
+        btn_browse.clicked.connect(self.show_storage_browser)
+
+    def show_storage_browser(self):
+        StorageBrowser(self).exec()
 
     def connect_signals(self):
         self.server.signals.log.connect(self.log)
         self.server.signals.client_connected.connect(self.add_client_to_list)
         self.server.signals.client_disconnected.connect(self.remove_client_from_list)
-        self.server.signals.image_received.connect(self.update_display)
         self.server.signals.request_access.connect(self.handle_request_access)
 
     @Slot(str, object)
-    def handle_request_access(self, ip_id, wait_event):
+    def handle_request_access(self, ip_id, ticket):
+        self.pending_admissions.append(ticket)
+        # requests arriving while a prompt is open are picked up by the loop below
+        if not self.admission_prompt_open:
+            self.prompt_pending_admissions()
+
+    def prompt_pending_admissions(self):
+        self.admission_prompt_open = True
         try:
-            reply = QMessageBox.question(self, "New Client Connection",
-                                        f"Accept connection from {ip_id}?",
-                                        QMessageBox.Yes | QMessageBox.No)
-            self.server.allow_connection = (reply == QMessageBox.Yes)
+            while self.pending_admissions:
+                ticket : AdmissionTicket = self.pending_admissions.popleft()
+                if not ticket.is_pending():
+                    continue
+
+                text = f"Accept connection from {ticket.ip_id}?"
+                if ticket.fingerprint:
+                    text += f"\nCertificate: {ticket.fingerprint}"
+                if self.pending_admissions:
+                    text += f"\n({len(self.pending_admissions)} more waiting)"
+                reply = QMessageBox.question(self, "New Client Connection", text,
+                                             QMessageBox.Yes | QMessageBox.YesToAll | QMessageBox.No)
+                if reply == QMessageBox.YesToAll:
+                    # always allow this host, including the ones already queued behind this prompt
+                    self.server.admission_policy.allow(ticket.host)
+                    for other in self.pending_admissions:
+                        if other.host == ticket.host:
+                            other.resolve(True)
+                    self.pending_admissions = deque(t for t in self.pending_admissions if t.host != ticket.host)
+                ticket.resolve(reply in (QMessageBox.Yes, QMessageBox.YesToAll))
         finally:
-            wait_event.set()
+            self.admission_prompt_open = False
 
     def show_context_menu(self, pos):
         item = self.list_clients.itemAt(pos)
@@ -383,6 +876,7 @@ class ServerGUI(QMainWindow):
 
     @Slot(str)
     def remove_client_from_list(self, ip_id):
+        self.last_response_time.pop(ip_id, None)
         items = self.list_clients.findItems(ip_id, Qt.MatchExactly)
         for item in items:
             self.list_clients.takeItem(self.list_clients.row(item))
@@ -425,8 +919,7 @@ class ServerGUI(QMainWindow):
 
         cmd = self.txt_query.text()
         if cmd:
-            for ip in checked_clients:
-                self.server.send_command(ip, cmd)
+            self.server.broadcast(checked_clients, cmd)
         self.txt_query.clear()
 
     def on_select_all_clicked(self):
@@ -443,25 +936,58 @@ class ServerGUI(QMainWindow):
             if widget:
                 widget.set_checked(False)
 
-    @Slot(str, str, str, str)
-    def update_display(self, ip, ts, b64_img, meta):
-        items = self.list_clients.findItems(ip, Qt.MatchExactly)
-        if items:
-            item = items[0]
-            widget = self.list_clients.itemWidget(item)
-            if widget:
-                widget.flash()
-
-        self.log(f"ALERT: Response received from {ip}")
-        self.lbl_meta.setText(f"<b>Source:</b> {ip}<br><b>Time:</b> {ts}")
-        
-        try:
-            img_data = base64.b64decode(b64_img)
-            qimg = QImage.fromData(img_data)
-            pixmap = QPixmap.fromImage(qimg)
-            self.lbl_image.setPixmap(pixmap.scaled(self.lbl_image.size(), Qt.KeepAspectRatio))
-        except Exception as e:
-            self.log(f"Error decoding image: {e}")
+    def refresh_display(self):
+        frames = self.server.display.take()
+        if not frames: return
+
+        now = time.time()
+        for ip in frames:
+            items = self.list_clients.findItems(ip, Qt.MatchExactly)
+            if items:
+                widget = self.list_clients.itemWidget(items[0])
+                if widget:
+                    widget.flash()
+            # the running counts are in lbl_meta, the log only gets first responses and returns from silence
+            if now - self.last_response_time.get(ip, 0) > SERVER_RESPONSE_IDLE_SECONDS:
+                self.log(f"ALERT: Response received from {ip}")
+            self.last_response_time[ip] = now
+
+        # only the newest frame is painted, the others were superseded within this refresh
+        ip, (ts, img_data, meta) = list(frames.items())[-1]
+        self.update_display(ip, ts, img_data, meta)
+
+    def update_display(self, ip, ts, img_data, meta):
+        stats = self.server.display.get_stats(ip)
+        self.lbl_meta.setText(f"<b>Source:</b> {ip}<br><b>Time:</b> {ts}<br>"
+                              f"<b>Frames:</b> {stats['received']} received, {stats['dropped']} dropped<br>"
+                              f"<b>Detections:</b> {describe_detections(meta) or 'none'}")
+        # metadata-only responses keep the last picture on screen
+        if not img_data: return
+
+        self.decode_generation += 1
+        self.pending_decode = (self.decode_generation, ip, ts, img_data)
+        self.start_pending_decode()
+
+    def start_pending_decode(self):
+        # the pool never holds more than one decode per thread, newer frames replace the pending one
+        if self.pending_decode is None or self.decodes_in_flight >= SERVER_DECODE_POOL_SIZE:
+            return
+        generation, ip, ts, img_data = self.pending_decode
+        self.pending_decode = None
+        self.decodes_in_flight += 1
+        self.decode_pool.start(ImageDecodeTask(self.decode_signals, generation, ip, ts, img_data, self.lbl_image.size()))
+
+    @Slot(int, str, str, object)
+    def on_image_decoded(self, generation, ip, ts, qimg):
+        self.decodes_in_flight -= 1
+        self.start_pending_decode()
+        if qimg.isNull():
+            self.log(f"Error decoding image from {ip}")
+            return
+        # a slower worker may finish after a newer frame was already painted
+        if generation > self.painted_generation:
+            self.painted_generation = generation
+            self.lbl_image.setPixmap(QPixmap.fromImage(qimg))
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,50 @@
+from common import *
+
+# Each entry point is imported in a fresh interpreter, so nothing is shared between measurements.
+ENTRY_POINTS = ['server', 'client', 'main', 'edge']
+HEAVY_MODULES = ['torch', 'ultralytics', 'cv2', 'numpy', 'PySide6.QtWidgets']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"import_s": time.perf_counter() - start,
+                  "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+def measure(module, runs):
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    process_times, import_times, heavy = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                             cwd=src_dir, capture_output=True, text=True)
+        process_times.append(time.perf_counter() - start)
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit code {out.returncode}")
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        import_times.append(result["import_s"])
+        heavy = result["heavy"]
+    return {
+        "entry": module,
+        "process_s": sorted(process_times)[len(process_times) // 2],
+        "import_s": sorted(import_times)[len(import_times) // 2],
+        "heavy": heavy,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how long each entry point takes to import")
+    parser.add_argument("--entries", nargs='+', default=ENTRY_POINTS)
+    parser.add_argument("--runs", type=int, default=3, help="median of this many cold starts")
+    args = parser.parse_args()
+
+    rows = []
+    for module in args.entries:
+        try:
+            rows.append(measure(module, args.runs))
+        except Exception as e:
+            print(f"\033[91m{module} failed: {e}\033[0m")
+
+    print(f"\n{'entry':<10}{'process s':>12}{'import s':>12}  heavy modules loaded")
+    for row in rows:
+        print(f"{row['entry']:<10}{row['process_s']:>12.2f}{row['import_s']:>12.2f}  {', '.join(row['heavy']) or '-'}")
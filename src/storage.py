@@ -0,0 +1,265 @@
+from common import *
+
+# Layout under SERVER_STORAGE_DIR, one directory per client:
+#   segment-000001.seg  records appended back to back:
+#                       RECORD_HEADER (magic, received_at, meta_len, data_len) + meta JSON + data
+#   index.idx           one fixed INDEX_ENTRY (received_at, segment, offset, length) per record,
+#                       in append order, pointing at the record header. received_at never goes
+#                       backwards within a client, so the index can be binary searched by time.
+RECORD_MAGIC = b'NXR1'
+RECORD_HEADER = struct.Struct('>4sdII')
+INDEX_ENTRY = struct.Struct('>dIQI')
+SEGMENT_NAME_FORMAT = "segment-{:06d}.seg"
+INDEX_FILE_NAME = "index.idx"
+
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+
+def client_dir_name(client_id):
+    return ''.join(ch if ch.isalnum() or ch in '.-' else '_' for ch in client_id) or '_'
+
+def encode_record(received_at, meta, data):
+    """Returns the record as a list of chunks, so the payload is written without being copied."""
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    return [RECORD_HEADER.pack(RECORD_MAGIC, received_at, len(meta_bytes), len(data)), meta_bytes, data]
+
+def split_attachments(meta, data):
+    """Splits a record's data back into its named attachments; records without an "attachments"
+    list in their meta hold a single image."""
+    if 'attachments' not in meta:
+        return {"image": data} if data else {}
+    blobs, offset = {}, 0
+    for attachment in meta['attachments']:
+        blobs[attachment['name']] = data[offset:offset + attachment['size']]
+        offset += attachment['size']
+    return blobs
+
+class _ClientLog:
+    """Open segment and index files of one client, only touched by the writer thread."""
+    def __init__(self, folder, segment_size):
+        self.folder = folder
+        self.segment_size = segment_size
+        os.makedirs(folder, exist_ok=True)
+
+        segments = sorted(name for name in os.listdir(folder) if name.startswith('segment-'))
+        self.segment_no = int(segments[-1][8:14]) if segments else 1
+        segment_path = os.path.join(folder, SEGMENT_NAME_FORMAT.format(self.segment_no))
+        index_path = os.path.join(folder, INDEX_FILE_NAME)
+        self.last_received_at = 0.0
+        self._recover(segment_path, index_path)
+        self.segment = open(segment_path, 'ab')
+        self.offset = self.segment.tell()
+        self.index = open(index_path, 'ab')
+
+    def _recover(self, segment_path, index_path):
+        """Cuts off what a crash left half-written before anything is appended: a torn trailing index
+        entry, entries whose record never fully reached the segment, and segment bytes no entry points to."""
+        segment_end = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+        keep_segment = 0
+        with open(index_path, 'a+b') as index:
+            entries = index.seek(0, os.SEEK_END) // INDEX_ENTRY.size
+            while entries:
+                index.seek((entries - 1) * INDEX_ENTRY.size)
+                received_at, segment_no, offset, length = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+                if segment_no < self.segment_no or (segment_no == self.segment_no and offset + length <= segment_end):
+                    self.last_received_at = received_at
+                    if segment_no == self.segment_no: keep_segment = offset + length
+                    break
+                entries -= 1
+            index.truncate(entries * INDEX_ENTRY.size)
+        if segment_end > keep_segment:
+            with open(segment_path, 'r+b') as segment:
+                segment.truncate(keep_segment)
+
+    def write(self, records):
+        if self.offset >= self.segment_size:
+            self.segment.close()
+            self.segment_no += 1
+            self.segment = open(os.path.join(self.folder, SEGMENT_NAME_FORMAT.format(self.segment_no)), 'ab')
+            self.offset = 0
+
+        chunks, entries = [], []
+        for received_at, meta, data in records:
+            # a wall clock stepping back must not break the time ordering of the index
+            received_at = self.last_received_at = max(received_at, self.last_received_at)
+            record = encode_record(received_at, meta, data)
+            length = sum(len(chunk) for chunk in record)
+            chunks.extend(record)
+            entries.append(INDEX_ENTRY.pack(received_at, self.segment_no, self.offset, length))
+            self.offset += length
+        self.segment.writelines(chunks)
+        self.index.write(b''.join(entries))
+
+    def flush(self, fsync):
+        self.segment.flush()
+        self.index.flush()
+        if fsync:
+            # data first, so a synced index entry never points past the synced segment
+            os.fsync(self.segment.fileno())
+            os.fsync(self.index.fileno())
+
+    def close(self):
+        self.flush(True)
+        self.segment.close()
+        self.index.close()
+
+class SegmentStore:
+    """Append-only per-client storage of received responses, written by one background thread."""
+    def __init__(self, root=SERVER_STORAGE_DIR, segment_size=SERVER_STORAGE_SEGMENT_SIZE,
+                 fsync_policy=SERVER_STORAGE_FSYNC_POLICY, fsync_interval=SERVER_STORAGE_FSYNC_INTERVAL):
+        self.root = root
+        self.segment_size = segment_size
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.queue : queue.Queue = queue.Queue(maxsize=SERVER_STORAGE_QUEUE_SIZE)
+        self.logs : dict[str, _ClientLog] = {}
+        self.records_written = 0
+        self.records_dropped = 0
+        self.last_fsync = time.time()
+        self._run_flag = True
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+
+    def append(self, client_id, meta, data):
+        """Never blocks the caller; records are dropped (and counted) when the writer falls behind."""
+        try:
+            self.queue.put_nowait((client_id, time.time(), meta, data))
+            return True
+        except queue.Full:
+            self.records_dropped += 1
+            return False
+
+    def close(self):
+        self._run_flag = False
+        self.thread.join()
+        for log in self.logs.values():
+            log.close()
+        self.logs.clear()
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=SERVER_STORAGE_BATCH_WAIT)]
+        except queue.Empty:
+            return []
+        size = len(batch[0][3])
+        while len(batch) < SERVER_STORAGE_BATCH_RECORDS and size < SERVER_STORAGE_BATCH_BYTES:
+            try: item = self.queue.get_nowait()
+            except queue.Empty: break
+            batch.append(item)
+            size += len(item[3])
+        return batch
+
+    def _writer_loop(self):
+        while self._run_flag or not self.queue.empty():
+            batch = self._next_batch()
+            if not batch: continue
+
+            by_client = {}
+            for client_id, received_at, meta, data in batch:
+                by_client.setdefault(client_id, []).append((received_at, meta, data))
+
+            now = time.time()
+            fsync = self.fsync_policy == FSYNC_ALWAYS or \
+                    (self.fsync_policy == FSYNC_INTERVAL and now - self.last_fsync >= self.fsync_interval)
+            try:
+                for client_id, records in by_client.items():
+                    log = self.logs.get(client_id)
+                    if log is None:
+                        log = self.logs[client_id] = _ClientLog(os.path.join(self.root, client_dir_name(client_id)), self.segment_size)
+                    log.write(records)
+                    log.flush(False)
+                if fsync:
+                    for log in self.logs.values():
+                        log.flush(True)
+                self.records_written += len(batch)
+            except Exception as e:
+                print(f"Failed to save data: {e}")
+            if fsync:
+                self.last_fsync = now
+
+RecordRef = namedtuple('RecordRef', ['client', 'received_at', 'segment', 'offset', 'length'])
+
+class _IndexView:
+    """Read-only snapshot of one client's index, entries are read on demand."""
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.count = os.fstat(self.file.fileno()).st_size // INDEX_ENTRY.size
+        self.map = mmap.mmap(self.file.fileno(), self.count * INDEX_ENTRY.size, access=mmap.ACCESS_READ) if self.count else None
+
+    def entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.map, i * INDEX_ENTRY.size)
+
+    def bisect(self, timestamp, right=False):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            received_at = self.entry(mid)[0]
+            if received_at < timestamp or (right and received_at == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start=None, end=None):
+        lo = self.bisect(start) if start is not None else 0
+        hi = self.bisect(end, right=True) if end is not None else self.count
+        return lo, max(lo, hi)
+
+    def close(self):
+        if self.map: self.map.close()
+        self.file.close()
+
+class StoreReader:
+    """Time-range queries over the SegmentStore layout, safe to use while the writer is appending."""
+    def __init__(self, root=SERVER_STORAGE_DIR):
+        self.root = root
+
+    def clients(self):
+        if not os.path.isdir(self.root): return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, INDEX_FILE_NAME)))
+
+    def _open(self, clients):
+        views = []
+        for client in clients if clients is not None else self.clients():
+            path = os.path.join(self.root, client_dir_name(client), INDEX_FILE_NAME)
+            if os.path.exists(path):
+                views.append((client_dir_name(client), _IndexView(path)))
+        return views
+
+    def count(self, clients=None, start=None, end=None):
+        views = self._open(clients)
+        try:
+            return sum(hi - lo for lo, hi in (view.range(start, end) for _, view in views))
+        finally:
+            for _, view in views: view.close()
+
+    def query(self, clients=None, start=None, end=None, skip=0, limit=SERVER_BROWSE_PAGE_SIZE):
+        """Newest first, across the given clients (all when None), `start`/`end` are epoch seconds, inclusive."""
+        views = self._open(clients)
+        try:
+            def newest_first(client, view):
+                lo, hi = view.range(start, end)
+                for i in range(hi - 1, lo - 1, -1):
+                    yield RecordRef(client, *view.entry(i))
+            merged = heapq.merge(*(newest_first(client, view) for client, view in views),
+                                 key=lambda ref: ref.received_at, reverse=True)
+            return list(itertools.islice(merged, skip, skip + limit))
+        finally:
+            for _, view in views: view.close()
+
+    def latest(self, limit, clients=None):
+        return self.query(clients, limit=limit)
+
+    def read(self, ref : RecordRef):
+        """Loads one record, returns (meta, data)."""
+        path = os.path.join(self.root, ref.client, SEGMENT_NAME_FORMAT.format(ref.segment))
+        with open(path, 'rb') as f:
+            f.seek(ref.offset)
+            record = f.read(ref.length)
+        magic, _, meta_len, data_len = RECORD_HEADER.unpack_from(record)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"Corrupt record at {path}:{ref.offset}")
+        meta_end = RECORD_HEADER.size + meta_len
+        return json.loads(record[RECORD_HEADER.size:meta_end]), record[meta_end:meta_end + data_len]
@@ -0,0 +1,83 @@
+from common import *
+import cv2
+import numpy as np
+
+class BoxTracker:
+    """Carries the boxes of the last detection pass across frames with sparse Lucas-Kanade optical flow.
+
+    Each box is moved by the median displacement of the corner features found inside it, tracking
+    runs on a downscaled grayscale copy of the frame. `update` returns the fraction of boxes that
+    are still followed, so the caller can schedule a new detection pass when tracking degrades.
+    """
+    def __init__(self, scale=NEXUS_TRACKER_SCALE):
+        self.scale = scale
+        self.base_results = None
+        self.boxes = None
+        self.prev_gray = None
+        self.points = None
+        self.owners = None
+
+    def prepare(self, frame):
+        """The tracker's view of a frame, cheap enough to compute ahead of the inference stage."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def reset(self, gray, results):
+        self.base_results = results
+        self.boxes = results.boxes.data.cpu().numpy().copy() if results is not None else np.zeros((0, 6), np.float32)
+        self.prev_gray = gray
+
+        points, owners = [], []
+        h, w = self.prev_gray.shape
+        for i, box in enumerate(self.boxes):
+            x1, y1, x2, y2 = (np.clip(box[:4] * self.scale, 0, [w, h, w, h])).astype(int)
+            if x2 - x1 < 4 or y2 - y1 < 4: continue
+            mask = np.zeros_like(self.prev_gray)
+            mask[y1:y2, x1:x2] = 255
+            corners = cv2.goodFeaturesToTrack(self.prev_gray, NEXUS_TRACKER_POINTS_PER_BOX, 0.01, 3, mask=mask)
+            if corners is None: continue
+            points.append(corners.reshape(-1, 2))
+            owners.append(np.full(len(corners), i))
+        self.points = np.concatenate(points).astype(np.float32) if points else np.zeros((0, 2), np.float32)
+        self.owners = np.concatenate(owners) if owners else np.zeros(0, int)
+
+    def update(self, gray) -> float:
+        if self.prev_gray is None or not len(self.boxes):
+            return 1.0
+        if not len(self.points):
+            self.prev_gray = gray
+            return 0.0
+
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.points.reshape(-1, 1, 2), None,
+                                                          winSize=(15, 15), maxLevel=2)
+        next_points = next_points.reshape(-1, 2)
+        good = status.reshape(-1) == 1
+
+        tracked = 0
+        keep = np.zeros(len(self.boxes), bool)
+        for i in range(len(self.boxes)):
+            mine = good & (self.owners == i)
+            if np.count_nonzero(mine) < NEXUS_TRACKER_MIN_POINTS: continue
+            dx, dy = np.median(next_points[mine] - self.points[mine], axis=0) / self.scale
+            self.boxes[i, [0, 2]] += dx
+            self.boxes[i, [1, 3]] += dy
+            keep[i] = True
+            tracked += 1
+
+        # boxes whose features were lost are dropped instead of being drawn frozen in place
+        index_map = np.cumsum(keep) - 1
+        self.boxes = self.boxes[keep]
+        self.points = next_points[good & keep[self.owners]]
+        self.owners = index_map[self.owners[good & keep[self.owners]]]
+        self.prev_gray = gray
+        return tracked / len(keep)
+
+    def results(self):
+        """The tracked boxes as an ultralytics Results object, so the draw path does not care where they came from."""
+        if self.base_results is None: return None
+        import torch
+        results = self.base_results.new()
+        results.update(boxes=torch.from_numpy(self.boxes))
+        return results